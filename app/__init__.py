@@ -1,8 +1,7 @@
 import os
 import rq
 from redis import Redis
-from elasticsearch import Elasticsearch
-from flask import Flask, request, current_app
+from flask import Flask, request, current_app, has_request_context
 from flask_babel import Babel
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
@@ -13,6 +12,7 @@ from flask_sqlalchemy import SQLAlchemy
 from logging.handlers import SMTPHandler, RotatingFileHandler
 import logging
 
+from app.search import create_backend
 from config import Config
 
 db = SQLAlchemy()
@@ -31,7 +31,7 @@ def create_app(config_class=Config):
     app = Flask(__name__, template_folder='templates')
     app.config.from_object(config_class)
 
-    app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) if app.config['ELASTICSEARCH_URL'] else None
+    app.search_backend = create_backend(app.config)
     app.redis = Redis.from_url(app.config['REDIS_URL'])
     app.task_queue = rq.Queue('blog-tasks', connection=app.redis)
 
@@ -101,6 +101,9 @@ def create_app(config_class=Config):
 
 @babel.localeselector
 def get_locale():
-    """Sets the most appropriate language for pages"""
+    """Sets the most appropriate language for pages. Background jobs use the default language"""
+
+    if not has_request_context():
+        return None
 
     return request.accept_languages.best_match(current_app.config['LANGUAGES'])
@@ -26,11 +26,35 @@ def basic_auth_error(status: int) -> Response:
     return error_response(status)
 
 
+class TokenUser:
+    """User authenticated by a token: the user is loaded from the database only when more than id is needed"""
+
+    def __init__(self, id: int):
+        self.id = id
+        self._user = None
+
+    @property
+    def user(self) -> User:
+        """Returns the user loading it on the first access"""
+
+        if self._user is None:
+            self._user = User.query.get(self.id)
+
+        return self._user
+
+    def revoke_token(self) -> None:
+        """Makes token of the user invalid"""
+
+        self.user.revoke_token()
+
+
 @token_auth.verify_token
-def verify_token(token: str) -> Optional[User]:
+def verify_token(token: str) -> Optional[TokenUser]:
     """Verifies token: validates token and token expiration and gets the user by token"""
 
-    return User.check_token(token) if token else None
+    user_id = User.get_user_id_by_token(token) if token else None
+
+    return TokenUser(user_id) if user_id is not None else None
 
 
 @token_auth.error_handler
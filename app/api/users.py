@@ -8,6 +8,17 @@ from app.api.errors import bad_request, error_response
 from app.models import User
 
 
+def _get_pagination_args() -> dict:
+    """Gets cursor pagination parameters of the collection request"""
+
+    return {
+        'objects_per_page': min(request.args.get('per_page', 10, type=int), 100),
+        'before': request.args.get('before'),
+        'after': request.args.get('after'),
+        'include_total': request.args.get('include_total', 0, type=int) == 1
+    }
+
+
 @bp.route('/users/<int:user_id>', methods=['GET'])
 @token_auth.login_required
 def get_user(user_id) -> Response:
@@ -21,9 +32,7 @@ def get_user(user_id) -> Response:
 def get_users() -> Response:
     """Returns all the users paginated"""
 
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(User.query, page, per_page, 'api.get_users')
+    data = User.to_collection_dict(User.query, endpoint='api.get_users', **_get_pagination_args())
 
     return jsonify(data)
 
@@ -34,9 +43,8 @@ def get_followers(user_id):
     """Returns followers for the user by user id"""
 
     user = User.query.get_or_404(user_id)
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(user.followers, page, per_page, 'api.get_followers', user_id=user_id)
+    data = User.to_collection_dict(user.followers, endpoint='api.get_followers', user_id=user_id,
+                                   **_get_pagination_args())
 
     return jsonify(data)
 
@@ -47,13 +55,48 @@ def get_followed(user_id) -> Response:
     """Returns users user {id} is following"""
 
     user = User.query.get_or_404(user_id)
-    page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(user.followed, page, per_page, 'api.get_followed', user_id=user_id)
+    data = User.to_collection_dict(user.followed, endpoint='api.get_followed', user_id=user_id,
+                                   **_get_pagination_args())
 
     return jsonify(data)
 
 
+@bp.route('/users/<int:user_id>/followed', methods=['POST'])
+@token_auth.login_required
+def import_followed(user_id) -> Response:
+    """Makes user {id} follow the users of {ids} list (up to 10000) at once: users can change their own follows only"""
+
+    if token_auth.current_user().id != user_id:
+        return error_response(403, message=_("Authorized user has no permissions for changes"))
+
+    ids = (request.get_json() or {}).get('ids')
+    if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+        return bad_request(_('Must include ids list of user ids'))
+    if len(ids) > 10000:
+        return bad_request(_('Up to 10000 ids are allowed'))
+
+    added = User.import_follows([(user_id, id) for id in ids])
+    db.session.commit()
+
+    return jsonify({'added': added})
+
+
+@bp.route('/users/<int:user_id>/following', methods=['GET'])
+@token_auth.login_required
+def get_following_among(user_id) -> Response:
+    """Returns which of the comma separated user {ids} (up to 100) user {id} is following"""
+
+    user = User.query.get_or_404(user_id)
+    try:
+        ids = [int(id) for id in request.args.get('ids', '').split(',') if id]
+    except ValueError:
+        return bad_request(_('ids must be comma separated user ids'))
+    if len(ids) > 100:
+        return bad_request(_('Up to 100 ids are allowed'))
+
+    return jsonify({'ids': sorted(user.get_followed_ids_among(ids))})
+
+
 @bp.route('/users', methods=['POST'])
 def create_user() -> Response:
     """Creates the user account"""
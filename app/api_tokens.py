@@ -0,0 +1,133 @@
+import os
+from datetime import datetime
+from hashlib import sha256
+from time import time
+
+import jwt
+import redis
+from flask import current_app
+
+
+# Generation of a token outlives the requests reading it: a fill is rejected once it is changed or expired
+GENERATION_TTL = 3600
+
+# Caches ARGV[1] user id in KEYS[1] for ARGV[2] seconds unless the KEYS[2] generation of the token differs from
+# ARGV[3] read before the token was looked up in the database, so the token is replaced or revoked since then
+_FILL = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') == tonumber(ARGV[3]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+"""
+
+
+def _cache_key(token: str) -> str:
+    return f'api-token:{sha256(token.encode("utf-8")).hexdigest()}'
+
+
+def _generation_key(token: str) -> str:
+    return f'api-token:generation:{sha256(token.encode("utf-8")).hexdigest()}'
+
+
+def _revoked_key(user_id: int) -> str:
+    return f'api-token:revoked-before:{user_id}'
+
+
+def get_cached_user_id(token: str) -> tuple:
+    """
+    Returns id of the user {token} belongs to if it is cached, None otherwise, and generation of the token to be
+    passed to cache_user_id, None if Redis is not available
+    """
+
+    try:
+        user_id, generation = current_app.redis.mget(_cache_key(token), _generation_key(token))
+    except redis.exceptions.RedisError:
+        return None, None
+
+    return int(user_id) if user_id else None, int(generation or 0)
+
+
+def cache_user_id(token: str, user_id: int, expiration: datetime, generation) -> None:
+    """
+    Caches id of the user {token} belongs to until the token {expiration} if the token is not replaced or revoked
+    since its {generation} was read
+    """
+
+    seconds = int((expiration - datetime.utcnow()).total_seconds())
+    if seconds <= 0 or generation is None:
+        return None
+
+    try:
+        script = current_app.redis.register_script(_FILL)
+        script(keys=[_cache_key(token), _generation_key(token)], args=[user_id, seconds, generation])
+    except redis.exceptions.RedisError:
+        pass
+
+
+def invalidate_after_commit(session, token: str) -> None:
+    """Schedules removal of the cached {token} once the {session} transaction changing the token is committed"""
+
+    session.info.setdefault('invalidated_tokens', set()).add(token)
+
+
+def after_commit(session) -> None:
+    """
+    Removes the tokens replaced or revoked by the committed transaction from the cache. Their generations are
+    advanced, so the requests which have read them from the database before the commit do not cache them again
+    """
+
+    tokens = session.info.pop('invalidated_tokens', set())
+    if not tokens:
+        return None
+
+    try:
+        pipeline = current_app.redis.pipeline()
+        for token in tokens:
+            pipeline.incr(_generation_key(token))
+            pipeline.expire(_generation_key(token), GENERATION_TTL)
+        pipeline.delete(*[_cache_key(token) for token in tokens])
+        pipeline.execute()
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not invalidate API tokens: Redis is not available')
+
+
+def after_rollback(session) -> None:
+    session.info.pop('invalidated_tokens', None)
+
+
+def generate_signed(user_id: int, expires_in: int) -> str:
+    """
+    Returns stateless token signed with SECRET_KEY identifying {user_id} for {expires_in} seconds,
+    API_TOKEN_MAX_EXPIRES_IN at most
+    """
+
+    now = time()
+    expires_in = min(expires_in, current_app.config['API_TOKEN_MAX_EXPIRES_IN'])
+    payload = {'sub': str(user_id), 'iat': now, 'exp': now + expires_in, 'jti': os.urandom(8).hex()}
+
+    return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+
+def verify_signed(token: str):
+    """
+    Returns id of the user the signed {token} belongs to, None if the token is invalid, expired or revoked.
+    Tokens are rejected while Redis holding the revocation list is not available
+    """
+
+    try:
+        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        user_id = int(payload['sub'])
+        revoked_before = current_app.redis.get(_revoked_key(user_id))
+    except (jwt.InvalidTokenError, KeyError, ValueError, redis.exceptions.RedisError):
+        return None
+
+    if revoked_before and payload['iat'] <= float(revoked_before):
+        return None
+
+    return user_id
+
+
+def revoke_signed(user_id: int) -> None:
+    """Revokes all the signed tokens of {user_id} issued so far: the mark is kept while they may be valid"""
+
+    current_app.redis.set(_revoked_key(user_id), time(), ex=current_app.config['API_TOKEN_MAX_EXPIRES_IN'])
+
@@ -0,0 +1,234 @@
+import random
+import statistics
+import tracemalloc
+from datetime import datetime, timedelta
+from itertools import accumulate
+from time import perf_counter
+
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models import User, Post, Message, followers
+
+# Password of all the generated users
+PASSWORD = 'benchmark'
+
+# Endpoint name -> url template filled with the username and id of a random user and a word of a random post
+ENDPOINTS = {
+    'index': '/index',
+    'explore': '/explore',
+    'search': '/search?text={word}',
+    'user_popup': '/user_profile/{username}/popup',
+    'notifications': '/notifications?since=0',
+    'api_users': '/api/users',
+    'api_user': '/api/users/{user_id}',
+    'api_followers': '/api/users/{user_id}/followers',
+}
+
+
+def _zipf_cum_weights(count: int, exponent=1.0) -> list[float]:
+    """Returns cumulative weights of {count} ranks following Zipf's law for random.choices"""
+
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def _insert_chunks(table, rows, chunk_size: int, on_progress=None) -> int:
+    """
+    Inserts {rows} into {table} with executemany chunks of {chunk_size} committed one by one. Core inserts skip the
+    model events, so no search outbox entries, fan-out or language detection jobs are created. Returns number of rows
+    """
+
+    inserted = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            db.session.execute(table.insert(), chunk)
+            db.session.commit()
+            inserted += len(chunk)
+            chunk = []
+            if on_progress:
+                on_progress(table.name, inserted)
+
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        inserted += len(chunk)
+        if on_progress:
+            on_progress(table.name, inserted)
+
+    return inserted
+
+
+def seed(users: int, posts: int, follows: int, messages: int, days=365, chunk_size=10000, seed=42,
+         on_progress=None) -> dict:
+    """
+    Generates {users} users following {follows} users on average, {posts} posts and {messages} messages written
+    over the last {days} days. Numbers of followers and posts per user follow power laws: a few users are followed
+    by many and write much. Returns numbers of the inserted rows by table
+    """
+
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(2, 9))) for _ in range(20000)]
+    word_weights = _zipf_cum_weights(len(vocabulary))
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(PASSWORD)
+
+    first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    user_ids = list(range(first_id, first_id + users))
+    # Popularity and activity ranks do not depend on the ids
+    popular = rng.sample(user_ids, len(user_ids))
+    popular_weights = _zipf_cum_weights(len(popular))
+    active = rng.sample(user_ids, len(user_ids))
+    active_weights = _zipf_cum_weights(len(active), 0.8)
+
+    def random_time():
+        return now - timedelta(seconds=rng.uniform(0, days * 24 * 3600))
+
+    def text(min_words: int, max_words: int) -> str:
+        return ' '.join(rng.choices(vocabulary, cum_weights=word_weights, k=rng.randint(min_words, max_words)))[:256]
+
+    def user_rows():
+        for id in user_ids:
+            yield {'id': id, 'username': f'user{id}', 'email': f'user{id}@example.com',
+                   'password_hash': password_hash, 'about_me': text(3, 15), 'last_seen': random_time()}
+
+    def follow_rows():
+        for id in user_ids:
+            # Pareto distributed number of followed users with the mean of {follows}
+            count = min(users - 1, int(follows / 2 * rng.paretovariate(2)))
+            followed = set(rng.choices(popular, cum_weights=popular_weights, k=count))
+            followed.discard(id)
+            for followed_id in sorted(followed):
+                yield {'follower_id': id, 'followed_id': followed_id}
+
+    def post_rows():
+        for author_id in rng.choices(active, cum_weights=active_weights, k=posts):
+            yield {'body': text(3, 40), 'timestamp': random_time(), 'user_id': author_id, 'language': 'en'}
+
+    def message_rows():
+        for _ in range(messages):
+            yield {'body': text(3, 30), 'timestamp': random_time(), 'sender_id': rng.choice(user_ids),
+                   'recipient_id': rng.choices(popular, cum_weights=popular_weights)[0]}
+
+    inserted = {'user': _insert_chunks(User.__table__, user_rows(), chunk_size, on_progress)}
+    if db.engine.dialect.name == 'postgresql':
+        # Explicit ids do not advance the sequence: users signing up later would get the ids taken
+        db.session.execute(db.text("SELECT setval(pg_get_serial_sequence('\"user\"', 'id'), max(id)) FROM \"user\""))
+        db.session.commit()
+    inserted.update({
+        'followers': _insert_chunks(followers, follow_rows(), chunk_size, on_progress),
+        'post': _insert_chunks(Post.__table__, post_rows(), chunk_size, on_progress),
+        'message': _insert_chunks(Message.__table__, message_rows(), chunk_size, on_progress),
+    })
+    User.recount()
+    db.session.commit()
+
+    return inserted
+
+
+def percentile(values: list[float], share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(app, user: User, requests=200, warmup=10, allocation_requests=20, endpoints=None, seed=42) -> dict:
+    """
+    Requests each of {endpoints} (all the ENDPOINTS by default) {requests} times through the test client as {user}
+    after {warmup} requests. Returns latency percentiles in milliseconds, mean number of queries, median peak of
+    allocated memory in KB measured by {allocation_requests} separate requests and number of failed requests
+    by endpoint name
+    """
+
+    rng = random.Random(seed)
+    user_count = db.session.query(db.func.count(User.id)).scalar()
+    targets = [(username, id) for username, id in db.session.query(User.username, User.id).filter(
+        User.id.in_([rng.randint(1, user_count) for _ in range(100)]))] or [(user.username, user.id)]
+    post_count = db.session.query(db.func.max(Post.id)).scalar() or 0
+    words = [word for body, in db.session.query(Post.body).filter(
+        Post.id.in_([rng.randint(1, post_count) for _ in range(100)])) for word in body.split()[:3]] or ['post']
+
+    token = user.get_token()
+    db.session.commit()
+    headers = {'Authorization': f'Bearer {token}'}
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+    queries = []
+
+    def count_query(*args):
+        queries.append(1)
+
+    def request(template: str) -> tuple[int, float]:
+        """Requests url of {template}. Returns status code and time of the request in milliseconds"""
+
+        username, user_id = rng.choice(targets)
+        url = template.format(username=username, user_id=user_id, word=rng.choice(words))
+        started = perf_counter()
+        response = client.get(url, headers=headers if url.startswith('/api/') else None)
+        response.get_data()
+        response.close()
+        elapsed = (perf_counter() - started) * 1000
+
+        # Requests share the application context of the caller, so its session is not removed after each of them
+        db.session.remove()
+
+        return response.status_code, elapsed
+
+    results = {}
+    db.event.listen(db.engine, 'before_cursor_execute', count_query)
+    try:
+        for name in endpoints or ENDPOINTS:
+            results[name] = _measure(ENDPOINTS[name], request, queries, requests, warmup, allocation_requests)
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', count_query)
+
+    return results
+
+
+def _measure(template: str, request, queries: list, requests: int, warmup: int, allocation_requests: int) -> dict:
+    """Requests the url of {template} with {request} function and measures it counting {queries}"""
+
+    for _ in range(warmup):
+        request(template)
+
+    latencies = []
+    query_counts = []
+    errors = 0
+    for _ in range(requests):
+        queries.clear()
+        status, elapsed = request(template)
+        latencies.append(elapsed)
+        query_counts.append(len(queries))
+        errors += status >= 400
+
+    # Tracing allocations slows the requests down, so they are measured apart from the latency
+    allocations = []
+    tracemalloc.start()
+    for _ in range(allocation_requests):
+        tracemalloc.reset_peak()
+        request(template)
+        allocations.append(tracemalloc.get_traced_memory()[1] / 1024)
+    tracemalloc.stop()
+
+    return {
+        'p50': round(percentile(latencies, 0.5), 2),
+        'p95': round(percentile(latencies, 0.95), 2),
+        'p99': round(percentile(latencies, 0.99), 2),
+        'queries': round(statistics.mean(query_counts), 2),
+        'allocated_kb': round(statistics.median(allocations), 1) if allocations else None,
+        'errors': errors,
+    }
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Returns relative change of p95 latency and queries of each endpoint against {baseline} results"""
+
+    changes = {}
+    for name, result in results.items():
+        if name in baseline:
+            changes[name] = {metric: (result[metric] - baseline[name][metric]) / baseline[name][metric]
+                             if baseline[name][metric] else 0.0 for metric in ('p95', 'queries')}
+
+    return changes
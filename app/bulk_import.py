@@ -0,0 +1,154 @@
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+from werkzeug.security import generate_password_hash
+
+from app import db, jobs
+from app.models import User, Post, execute_many, insert_ignoring_duplicates
+
+
+def read_ndjson(file, chunk_size: int):
+    """Yields lists of up to {chunk_size} records of the NDJSON {file} and number of the malformed lines in each"""
+
+    chunk = []
+    malformed = 0
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if isinstance(record, dict):
+            chunk.append(record)
+        else:
+            malformed += 1
+
+        if len(chunk) == chunk_size:
+            yield chunk, malformed
+            chunk, malformed = [], 0
+
+    if chunk or malformed:
+        yield chunk, malformed
+
+
+def import_users(records: list[dict], executor=None) -> int:
+    """
+    Inserts users of {records} with one executemany statement. Records have username, email, password_hash or
+    password hashed by {executor} processes if it is set, optional about_me and last_seen. Records without username,
+    email or password string fitting the columns or with the username or email taken already are skipped, about_me
+    is truncated to the column. Returns number of inserted users
+    """
+
+    usernames = set()
+    emails = set()
+    rows = []
+    for record in records:
+        username, email = record.get('username'), record.get('email')
+        password_hash, password = record.get('password_hash'), record.get('password')
+        if not isinstance(username, str) or not isinstance(email, str) or not 0 < len(username) <= 64 or \
+                not 0 < len(email) <= 128 or username in usernames or email in emails:
+            continue
+        if password_hash is not None:
+            if not isinstance(password_hash, str) or not 0 < len(password_hash) <= 128:
+                continue
+        elif not isinstance(password, str) or not password:
+            continue
+
+        usernames.add(username)
+        emails.add(email)
+        about_me = record.get('about_me')
+        rows.append({'username': username, 'email': email, 'password_hash': password_hash, 'password': password,
+                     'about_me': about_me[:128] if isinstance(about_me, str) else None,
+                     'last_seen': _parse_timestamp(record.get('last_seen'))})
+
+    taken = db.session.query(User.username, User.email).filter(
+        db.or_(User.username.in_(usernames), User.email.in_(emails))).all()
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email for _, email in taken}
+    rows = [row for row in rows if row['username'] not in taken_usernames and row['email'] not in taken_emails]
+
+    # Hashing is slow by design: pre-hashed passwords are taken as they are, the rest are hashed in parallel
+    plain = [row for row in rows if not row['password_hash']]
+    passwords = [row['password'] for row in plain]
+    hashes = executor.map(generate_password_hash, passwords, chunksize=64) if executor else \
+        map(generate_password_hash, passwords)
+    for row, password_hash in zip(plain, hashes):
+        row['password_hash'] = password_hash
+
+    if not rows:
+        return 0
+
+    # Rows taken by the concurrent imports are skipped by the insert itself
+    return execute_many(insert_ignoring_duplicates(User.__table__), [
+        {field: row[field] for field in ('username', 'email', 'password_hash', 'about_me', 'last_seen')}
+        for row in rows])
+
+
+def import_posts(records: list[dict]) -> tuple[int, int]:
+    """
+    Inserts posts of {records} with one executemany statement. Records have body, author's user_id or username and
+    optional timestamp and language. Posts without language are saved with the empty one to be detected later,
+    records without body or known author are skipped. Post counters of the authors are incremented and timelines
+    of the authors and their followers are dropped once committed, to be rebuilt with the posts on the next read.
+    Returns numbers of inserted posts and of the posts waiting for language detection
+    """
+
+    # JSON true is an int to isinstance: only the exact type is taken
+    user_ids = {record['user_id'] for record in records if type(record.get('user_id')) is int}
+    usernames = {record['username'] for record in records
+                 if 'user_id' not in record and isinstance(record.get('username'), str)}
+    known_ids = set()
+    ids_by_username = {}
+    if user_ids:
+        known_ids = {id for id, in db.session.query(User.id).filter(User.id.in_(user_ids))}
+    if usernames:
+        ids_by_username = dict(db.session.query(User.username, User.id).filter(User.username.in_(usernames)))
+
+    rows = []
+    for record in records:
+        user_id, username = record.get('user_id'), record.get('username')
+        if 'user_id' in record:
+            user_id = user_id if type(user_id) is int and user_id in known_ids else None
+        else:
+            user_id = ids_by_username.get(username) if isinstance(username, str) else None
+        body = record.get('body')
+        if user_id is None or not isinstance(body, str):
+            continue
+
+        language = record.get('language')
+        rows.append({'body': body[:256], 'timestamp': _parse_timestamp(record.get('timestamp')), 'user_id': user_id,
+                     'language': language[:5] if isinstance(language, str) else ''})
+
+    if not rows:
+        return 0, 0
+
+    # Core insert skips the model events: posts are indexed and their languages detected after the import
+    db.session.execute(Post.__table__.insert(), rows)
+    deltas = Counter(row['user_id'] for row in rows)
+    db.session.execute(User.__table__.update().where(User.id == db.bindparam('author_id')).values(
+        post_count=User.post_count + db.bindparam('delta')),
+        [{'author_id': user_id, 'delta': delta} for user_id, delta in sorted(deltas.items())])
+    # Fanning the posts out one by one would be slower than rebuilding the timelines, which may also be never read
+    jobs.enqueue_after_commit(db.session, 'invalidate_timelines', tuple(sorted(deltas)))
+
+    return len(rows), sum(1 for row in rows if not row['language'])
+
+
+def _parse_timestamp(value) -> datetime:
+    """Returns naive UTC datetime of ISO 8601 {value}, current time if it is missing or malformed"""
+
+    if isinstance(value, str):
+        try:
+            timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+        else:
+            if timestamp.tzinfo:
+                timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+            return timestamp
+
+    return datetime.utcnow()
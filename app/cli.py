@@ -1,6 +1,16 @@
+import csv
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import click
 
+from app import bench, bulk_import, db, language
+from app.mixins import SearchableMixin
+from app.models import User, Post, Message, SearchOutbox, followers
+from app.search import get_cache_stats
+
 
 def register(app):
     """Function to manage language translations, created to remove the reference to app"""
@@ -41,3 +51,322 @@ def register(app):
         if os.system('pybabel init -i messages.pot -d app/translations -l ' + lang):
             raise RuntimeError('init command failed')
         os.remove('messages.pot')
+
+    @app.cli.group()
+    def counters():
+        """
+        Command line operations for denormalized user counters.
+        Subcommands available: recount
+        """
+
+        pass
+
+    @counters.command()
+    def recount():
+        """Recomputes post, follower and followed counters of all the users"""
+
+        User.recount()
+        db.session.commit()
+
+    @app.cli.group()
+    def follows():
+        """
+        Command line operations for the follow graph mirrored in Redis.
+        Subcommands available: rebuild, import {file}
+        """
+
+        pass
+
+    @follows.command('import')
+    @click.argument('file', type=click.File())
+    @click.option('--chunk-size', default=10000, help='Number of edges inserted and committed at once')
+    def import_follows(file, chunk_size):
+        """Imports follower_id,followed_id lines of the CSV file skipping the follows which exist already"""
+
+        skipped = 0
+
+        def read_chunks():
+            nonlocal skipped
+            chunk = []
+            for line_number, row in enumerate(csv.reader(file), 1):
+                if not row:
+                    continue
+                if len(row) != 2 or not all(value.strip().isdecimal() for value in row):
+                    # The header is not counted
+                    skipped += line_number > 1
+                    continue
+                chunk.append((int(row[0]), int(row[1])))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        started = time.time()
+        read = added = 0
+        for chunk in read_chunks():
+            added += User.import_follows(chunk)
+            db.session.commit()
+            read += len(chunk)
+            click.echo(f'{read} lines read, {added} follows added, {skipped} malformed lines skipped')
+
+        click.echo(f'{added} follows added, {skipped} malformed lines skipped in {time.time() - started:.1f}s')
+
+    @follows.command()
+    @click.option('--chunk-size', default=1000, help='Number of users read at once')
+    def rebuild(chunk_size):
+        """Rebuilds the sets of followed users of all the users from the database"""
+
+        started = time.time()
+        rebuilt = User.rebuild_follow_graph(chunk_size)
+        click.echo(f'{rebuilt} users rebuilt in {time.time() - started:.1f}s')
+
+    @app.cli.group()
+    def search():
+        """
+        Command line operations for the search index.
+        Subcommands available: reindex {index}, lag, cache-stats
+        """
+
+        pass
+
+    @search.command()
+    def lag():
+        """Shows number of index changes waiting in the outbox and age of the oldest one"""
+
+        lag = SearchOutbox.get_lag()
+        click.echo(f'{lag["pending"]} changes pending, lag {lag["lag"]:.1f}s')
+
+    @search.command()
+    @click.argument('index')
+    @click.option('--chunk-size', default=1000, help='Number of rows read and sent at once')
+    @click.option('--workers', default=4, help='Number of threads sending chunks to Elasticsearch')
+    @click.option('--new-index', is_flag=True, help='Build a fresh index and switch the alias to it when done')
+    @click.option('--resume', is_flag=True, help='Continue the interrupted run from its last checkpoint')
+    def reindex(index, chunk_size, workers, new_index, resume):
+        """Refreshes the index with all the data from the model"""
+
+        if not app.search_backend:
+            raise click.ClickException('Neither ELASTICSEARCH_URL nor SEARCH_INDEX_PATH is configured')
+
+        models = {model.__tablename__: model for model in SearchableMixin.__subclasses__()}
+        if index not in models:
+            raise click.BadParameter(f'choose from {", ".join(models)}', param_hint='index')
+
+        started = time.time()
+        sent = models[index].reindex(chunk_size, workers, new_index, resume,
+                                     lambda sent, last_id: click.echo(f'{sent} entries sent, last id {last_id}'))
+        click.echo(f'{sent} entries indexed in {time.time() - started:.1f}s')
+
+    @search.command('cache-stats')
+    def cache_stats():
+        """Shows lookups and hit ratio of the search results cache per index"""
+
+        for index, (lookups, hits) in get_cache_stats().items():
+            click.echo(f'{index}: {lookups} lookups, {hits} hits ({100 * hits / lookups if lookups else 0:.1f}%)')
+
+    @app.cli.group()
+    def posts():
+        """
+        Command line operations for the posts.
+        Subcommands available: detect-language
+        """
+
+        pass
+
+    @posts.command('detect-language')
+    @click.option('--all', 'all_posts', is_flag=True, help='Detect language of all the posts, not only undetected')
+    @click.option('--chunk-size', default=1000, help='Number of posts sent to a worker process at once')
+    @click.option('--workers', default=os.cpu_count(), help='Number of worker processes detecting languages')
+    def detect_language(all_posts, chunk_size, workers):
+        """Backfills language of the existing posts"""
+
+        query = db.session.query(Post.id, Post.body)
+        if not all_posts:
+            query = query.filter(db.or_(Post.language.is_(None), Post.language == ''))
+
+        def read_chunks():
+            after_id = 0
+            while True:
+                chunk = query.filter(Post.id > after_id).order_by(Post.id).limit(chunk_size).all()
+                if not chunk:
+                    return None
+                after_id = chunk[-1].id
+                yield [tuple(row) for row in chunk]
+
+        update = Post.__table__.update().where(Post.id == db.bindparam('post_id')).values(
+            language=db.bindparam('detected_language'))
+        started = time.time()
+        updated = 0
+
+        with ProcessPoolExecutor(workers, initializer=language.preload) as executor:
+            chunks = read_chunks()
+            # Chunks being detected are limited, so the posts are not all read into memory at once
+            futures = [executor.submit(language.detect_languages, chunk) for _, chunk in zip(range(workers * 2), chunks)]
+            while futures:
+                languages = futures.pop(0).result()
+                db.session.execute(update, [{'post_id': id, 'detected_language': detected}
+                                            for id, detected in languages])
+                SearchOutbox.add_changes(db.session, [{'index': Post.__tablename__, 'object_id': id,
+                                                       'operation': 'index'} for id, _ in languages])
+                db.session.commit()
+                updated += len(languages)
+                click.echo(f'{updated} posts updated, last id {languages[-1][0]}')
+
+                chunk = next(chunks, None)
+                if chunk:
+                    futures.append(executor.submit(language.detect_languages, chunk))
+
+        click.echo(f'{updated} posts updated in {time.time() - started:.1f}s')
+
+    @app.cli.group('bench')
+    def bench_group():
+        """
+        Command line operations for benchmarks of the endpoints on synthetic data.
+        Subcommands available: seed, run
+        """
+
+        pass
+
+    @bench_group.command('seed')
+    @click.option('--users', default=10000, help='Number of users')
+    @click.option('--posts', default=1000000, help='Number of posts')
+    @click.option('--follows', default=20, help='Mean number of users followed by a user')
+    @click.option('--messages', default=100000, help='Number of private messages')
+    @click.option('--chunk-size', default=10000, help='Number of rows inserted at once')
+    @click.option('--seed', 'random_seed', default=42, help='Seed of the random generator')
+    def seed_data(users, posts, follows, messages, chunk_size, random_seed):
+        """Generates users, follows with power-law distributed followers, posts and messages"""
+
+        started = time.time()
+        inserted = bench.seed(users, posts, follows, messages, chunk_size=chunk_size, seed=random_seed,
+                              on_progress=lambda table, count: click.echo(f'{count} {table} rows inserted'))
+        elapsed = time.time() - started
+        click.echo(f'{sum(inserted.values())} rows inserted in {elapsed:.1f}s '
+                   f'({sum(inserted.values()) / elapsed:.0f} rows/s). Passwords of the users are '
+                   f'"{bench.PASSWORD}", run "flask search reindex post" to benchmark search')
+
+    @bench_group.command('run')
+    @click.option('--username', help='User to make requests as, the one following most users by default')
+    @click.option('--endpoint', 'endpoints', multiple=True, type=click.Choice(list(bench.ENDPOINTS)),
+                  help='Endpoint to benchmark, all of them by default')
+    @click.option('--requests', default=200, type=click.IntRange(min=1),
+                  help='Number of measured requests per endpoint')
+    @click.option('--warmup', default=10, type=click.IntRange(min=0),
+                  help='Number of requests per endpoint made before measuring')
+    @click.option('--allocation-requests', default=20, type=click.IntRange(min=0),
+                  help='Number of requests per endpoint tracing allocations, 0 not to trace them')
+    @click.option('--baseline', type=click.File(), help='JSON results of a previous run to compare with')
+    @click.option('--save', type=click.File('w'), help='File to save JSON results to')
+    @click.option('--max-regression', type=float,
+                  help='Fail if p95 latency or queries of an endpoint grow more than this share of the baseline '
+                       'or any request fails')
+    def run_benchmark(username, endpoints, requests, warmup, allocation_requests, baseline, save, max_regression):
+        """Requests the endpoints through the test client reporting latency, queries and allocations"""
+
+        if username:
+            user = User.query.filter_by(username=username).first()
+        else:
+            user = User.query.order_by(User.followed_count.desc()).first()
+        if not user:
+            raise click.ClickException('No user to make requests as: run "flask bench seed" first')
+
+        rows = {table.name: db.session.query(db.func.count()).select_from(table).scalar()
+                for table in (User.__table__, followers, Post.__table__, Message.__table__)}
+        click.echo(f'{", ".join(f"{count} {table}" for table, count in rows.items())}, requests as {user.username}')
+
+        results = bench.run(app, user, requests, warmup, allocation_requests, endpoints)
+        changes = bench.compare(results, json.load(baseline)['endpoints']) if baseline else {}
+
+        click.echo(f'{"endpoint":<14} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"alloc KB":>9} '
+                   f'{"errors":>6}' + (f' {"p95 +/-":>8} {"queries +/-":>11}' if changes else ''))
+        for name, result in results.items():
+            allocated = '-' if result['allocated_kb'] is None else f'{result["allocated_kb"]:.1f}'
+            line = (f'{name:<14} {result["p50"]:>8.2f} {result["p95"]:>8.2f} {result["p99"]:>8.2f} '
+                    f'{result["queries"]:>8.1f} {allocated:>9} {result["errors"]:>6}')
+            if name in changes:
+                line += f' {changes[name]["p95"]:>+8.0%} {changes[name]["queries"]:>+11.0%}'
+            click.echo(line)
+
+        if save:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'rows': rows,
+                       'endpoints': results}, save, indent=4)
+
+        if max_regression is None:
+            return None
+
+        # Latency of failing requests is not comparable: an endpoint failing fast would look faster
+        failed = [name for name, result in results.items() if result['errors']]
+        regressed = [name for name, change in changes.items() if max(change.values()) > max_regression]
+        if failed or regressed:
+            raise click.ClickException('; '.join(
+                ([f'Failed requests: {", ".join(failed)}'] if failed else []) +
+                ([f'Regressed more than {max_regression:.0%}: {", ".join(regressed)}'] if regressed else [])))
+
+    @app.cli.group('import')
+    def import_group():
+        """
+        Command line operations for bulk import of NDJSON files with one JSON object per line, - reads stdin.
+        Subcommands available: users {file}, posts {file}
+        """
+
+        pass
+
+    @import_group.command('users')
+    @click.argument('file', type=click.File())
+    @click.option('--chunk-size', default=10000, help='Number of users inserted and committed at once')
+    @click.option('--workers', default=os.cpu_count(), help='Number of worker processes hashing plain passwords')
+    def import_users(file, chunk_size, workers):
+        """
+        Imports users with username, email, password_hash or plain password, about_me and last_seen fields.
+        Users with taken username or email are skipped
+        """
+
+        started = time.time()
+        read = imported = 0
+        # Processes are started only when there are plain passwords to hash
+        with ProcessPoolExecutor(workers) as executor:
+            for records, malformed in bulk_import.read_ndjson(file, chunk_size):
+                imported += bulk_import.import_users(records, executor)
+                db.session.commit()
+                read += len(records) + malformed
+                click.echo(f'{read} lines read, {imported} users imported '
+                           f'({imported / (time.time() - started):.0f} rows/s)')
+
+        click.echo(f'{imported} users imported, {read - imported} lines skipped in {time.time() - started:.1f}s')
+
+    @import_group.command('posts')
+    @click.argument('file', type=click.File())
+    @click.option('--chunk-size', default=10000, help='Number of posts inserted and committed at once')
+    @click.option('--index/--no-index', default=True, help='Send the imported posts to the search index at the end')
+    @click.option('--workers', default=4, help='Number of threads sending the posts to the search index')
+    def import_posts(file, chunk_size, index, workers):
+        """
+        Imports posts with body, user_id or username of the author, timestamp and language fields. Posts are indexed
+        once all of them are inserted, languages of the posts without one are left for "flask posts detect-language"
+        """
+
+        after_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+        started = time.time()
+        read = imported = undetected = 0
+        for records, malformed in bulk_import.read_ndjson(file, chunk_size):
+            inserted, without_language = bulk_import.import_posts(records)
+            db.session.commit()
+            read += len(records) + malformed
+            imported += inserted
+            undetected += without_language
+            click.echo(f'{read} lines read, {imported} posts imported ({imported / (time.time() - started):.0f} rows/s)')
+
+        click.echo(f'{imported} posts imported, {read - imported} lines skipped in {time.time() - started:.1f}s')
+
+        if index and app.search_backend and imported:
+            started = time.time()
+            try:
+                sent = Post.index_after(after_id, 1000, workers, on_progress=lambda sent, last_id: click.echo(
+                    f'{sent} posts indexed, last id {last_id}'))
+            except RuntimeError as error:
+                raise click.ClickException(f'{error}: run "flask search reindex post" to index them')
+            click.echo(f'{sent} posts indexed in {time.time() - started:.1f}s')
+
+        if undetected:
+            click.echo(f'{undetected} posts wait for language detection: run "flask posts detect-language"')
@@ -0,0 +1,124 @@
+import csv
+import gzip
+import io
+import json
+import os
+import secrets
+from glob import glob
+from time import time
+
+from app import db
+from app.models import Post
+from app.pagination import compare_keys
+
+# Export format -> (content type, file extension)
+FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+FIELDS = ['timestamp', 'body']
+
+
+def read_posts(user_id: int, chunk_size=1000):
+    """
+    Yields posts of {user_id} as dictionaries oldest first. Rows are read in chunks of {chunk_size} by separate
+    keyset queries, so they are never all loaded at once and no cursor is kept open between the chunks
+    """
+
+    columns = [Post.timestamp, Post.id]
+    query = db.session.query(Post.timestamp, Post.id, Post.body).filter(Post.user_id == user_id).order_by(
+        Post.timestamp.asc(), Post.id.asc())
+    chunk = query.limit(chunk_size).all()
+
+    while chunk:
+        for timestamp, id, body in chunk:
+            yield {'timestamp': timestamp.isoformat() + 'Z', 'body': body}
+
+        last = chunk[-1]
+        chunk = query.filter(compare_keys(columns, [last.timestamp, last.id], True)).limit(chunk_size).all()
+
+
+def write_posts(posts, output, export_format: str) -> None:
+    """Writes {posts} dictionaries to the binary {output} file in {export_format} one by one"""
+
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='', write_through=True)
+
+    if export_format == 'csv':
+        writer = csv.DictWriter(text, FIELDS)
+        writer.writeheader()
+        writer.writerows(posts)
+
+    elif export_format == 'ndjson':
+        for post in posts:
+            text.write(json.dumps(post, ensure_ascii=False) + '\n')
+
+    else:
+        text.write('{"posts": [')
+        for i, post in enumerate(posts):
+            text.write((',\n' if i else '\n') + json.dumps(post, ensure_ascii=False))
+        text.write('\n]}\n')
+
+    text.flush()
+    # Output stays open for the caller
+    text.detach()
+
+
+def new_filename(user_id: int, export_format='json', compress=False) -> str:
+    """Returns a random name of the file for the new export of {user_id}: the name is not guessable"""
+
+    return f'{user_id}-{secrets.token_urlsafe(16)}.{FORMATS[export_format][1]}' + ('.gz' if compress else '')
+
+
+def is_owner(filename: str, user_id: int) -> bool:
+    """Checks whether {filename} is a name of the export of {user_id}"""
+
+    return filename.startswith(f'{user_id}-') and os.path.basename(filename) == filename and \
+        not filename.endswith('.tmp')
+
+
+def get_download_name(filename: str) -> str:
+    """Returns name of the downloaded export file without the user id and random part"""
+
+    return 'posts.' + filename.split('.', 1)[1]
+
+
+def save_posts(posts, directory: str, filename: str, export_format='json', compress=False) -> str:
+    """
+    Writes {posts} into {filename} in {directory} and removes the previous exports of the user. The file is written
+    under a temporary name first, so it is never downloaded incomplete. Returns path of the file
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+
+    with open(path + '.tmp', 'wb') as output:
+        if compress:
+            with gzip.GzipFile(filename=get_download_name(filename)[:-3], mode='wb', fileobj=output) as archive:
+                write_posts(posts, archive, export_format)
+        else:
+            write_posts(posts, output, export_format)
+    os.replace(path + '.tmp', path)
+
+    user_id = filename.split('-', 1)[0]
+    for previous in glob(os.path.join(directory, f'{user_id}-*')):
+        if previous != path and not previous.endswith('.tmp'):
+            os.remove(previous)
+
+    return path
+
+
+def remove_expired(directory: str, ttl: int) -> int:
+    """Removes exports older than {ttl} seconds from {directory}. Returns number of removed files"""
+
+    removed = 0
+    for path in glob(os.path.join(directory, '*')):
+        try:
+            if os.path.getmtime(path) < time() - ttl:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+
+    return removed
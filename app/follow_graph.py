@@ -0,0 +1,133 @@
+import redis
+from flask import current_app
+
+# Member of every materialized set, so the set of a user following nobody exists too
+MARKER = '0'
+
+# Returns 1 or 0 for every KEYS[i] set containing ARGV[i] member or not, -1 when the set is not materialized
+_CONTAINS = """
+local found = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 0 then
+        found[i] = -1
+    else
+        found[i] = redis.call('SISMEMBER', key, ARGV[i])
+    end
+end
+return found
+"""
+
+# Applies ARGV[i + 1] ('SADD' or 'SREM') of ARGV[i + 2] member to every KEYS[i] set if it exists and bumps KEYS[i + 1]
+# version of it expiring in ARGV[1] seconds, so the sets being loaded from the database meanwhile are not saved
+_APPLY_TO_EXISTING = """
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call(ARGV[i + 1], KEYS[i], ARGV[i + 2])
+    end
+    redis.call('INCR', KEYS[i + 1])
+    redis.call('EXPIRE', KEYS[i + 1], ARGV[1])
+end
+return 0
+"""
+
+
+def _key(user_id: int) -> str:
+    return f'follow-graph:{user_id}'
+
+
+def _version_key(user_id: int) -> str:
+    return f'follow-graph-version:{user_id}'
+
+
+def contains(pairs: list[tuple[int, int]]) -> list:
+    """
+    Checks whether follower follows followed user for each (follower id, followed id) of {pairs} with one call.
+    Returns True or False for each pair, None where the set of the follower is not materialized
+    """
+
+    if not pairs:
+        return []
+
+    script = current_app.redis.register_script(_CONTAINS)
+    found = script(keys=[_key(follower_id) for follower_id, _ in pairs],
+                   args=[followed_id for _, followed_id in pairs])
+
+    return [None if value == -1 else bool(value) for value in found]
+
+
+def fill(user_ids, load) -> dict[int, set]:
+    """
+    Materializes sets of the users followed by each of {user_ids} returned by {load} function as user id -> followed
+    ids mapping. Sets are not saved if any of the users follows or unfollows somebody while they are loaded, since the
+    change may be missing in them. Returns the loaded mapping
+    """
+
+    with current_app.redis.pipeline() as pipeline:
+        pipeline.watch(*[_version_key(user_id) for user_id in user_ids])
+        followed_ids = load(user_ids)
+
+        pipeline.multi()
+        for user_id, ids in followed_ids.items():
+            key = _key(user_id)
+            pipeline.delete(key)
+            pipeline.sadd(key, MARKER, *ids)
+            pipeline.expire(key, current_app.config['FOLLOW_GRAPH_TTL'])
+        try:
+            pipeline.execute()
+        except redis.exceptions.WatchError:
+            pass
+
+    return followed_ids
+
+
+def clear() -> int:
+    """Removes all the materialized sets. Returns number of removed sets"""
+
+    removed = 0
+    keys = []
+    for key in current_app.redis.scan_iter(match=_key('*'), count=1000):
+        keys.append(key)
+        if len(keys) == 1000:
+            removed += current_app.redis.delete(*keys)
+            keys = []
+    if keys:
+        removed += current_app.redis.delete(*keys)
+
+    return removed
+
+
+def change_after_commit(session, follower_id: int, followed_id: int, following: bool) -> None:
+    """Schedules adding or removing of the follow edge once the {session} transaction changing it is committed"""
+
+    session.info.setdefault('follow_graph_changes', []).append((follower_id, followed_id, following))
+
+
+def get_pending(session) -> dict:
+    """Returns (follower id, followed id) -> following mapping of the changes not committed by {session} yet"""
+
+    return {(follower_id, followed_id): following
+            for follower_id, followed_id, following in session.info.get('follow_graph_changes', [])}
+
+
+def after_commit(session) -> None:
+    """Applies the committed follow changes to the materialized sets in their order"""
+
+    changes = session.info.pop('follow_graph_changes', [])
+    if not changes:
+        return None
+
+    keys = []
+    args = [current_app.config['FOLLOW_GRAPH_TTL']]
+    for follower_id, followed_id, following in changes:
+        keys.extend([_key(follower_id), _version_key(follower_id)])
+        args.extend(['SADD' if following else 'SREM', followed_id])
+
+    try:
+        script = current_app.redis.register_script(_APPLY_TO_EXISTING)
+        script(keys=keys, args=args)
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not update follow graph: Redis is not available')
+
+
+def after_rollback(session) -> None:
+    session.info.pop('follow_graph_changes', None)
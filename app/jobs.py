@@ -0,0 +1,28 @@
+import redis
+from flask import current_app
+
+
+def enqueue_after_commit(session, name: str, *args, **kwargs) -> None:
+    """
+    Schedules the {name} job from tasks.py to be queued once the {session} transaction is committed.
+    The same job with the same arguments is queued once per transaction
+    """
+
+    pending_jobs = session.info.setdefault('pending_jobs', {})
+    pending_jobs.setdefault((name, args), kwargs)
+
+
+def after_commit(session) -> None:
+    """Queues the jobs scheduled during the committed transaction"""
+
+    for (name, args), kwargs in session.info.pop('pending_jobs', {}).items():
+        try:
+            current_app.task_queue.enqueue('app.tasks.' + name, *args, **kwargs)
+        except redis.exceptions.RedisError:
+            current_app.logger.warning(f'Could not queue {name} job: Redis is not available')
+
+
+def after_rollback(session) -> None:
+    """Drops the jobs scheduled during the rolled back transaction"""
+
+    session.info.pop('pending_jobs', None)
@@ -0,0 +1,26 @@
+from langdetect import DetectorFactory, LangDetectException, detect
+from langdetect.detector_factory import init_factory
+
+# Same text is always detected the same way
+DetectorFactory.seed = 0
+
+
+def preload() -> None:
+    """Loads language profiles of the detector: otherwise they are loaded by the first detection in the process"""
+
+    init_factory()
+
+
+def detect_language(text: str) -> str:
+    """Returns code of the {text} language or empty string if it can not be detected"""
+
+    try:
+        return detect(text)[:5]
+    except LangDetectException:
+        return ''
+
+
+def detect_languages(posts: list[tuple[int, str]]) -> list[tuple[int, str]]:
+    """Returns (id, language) pairs for (id, text) {posts}: runs in the backfill worker processes"""
+
+    return [(id, detect_language(text or '')) for id, text in posts]
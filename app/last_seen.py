@@ -0,0 +1,103 @@
+import threading
+from datetime import datetime, timedelta
+from time import monotonic, time
+
+import redis
+from flask import current_app
+
+from app import db
+from app.models import User
+
+# Hash of user id -> last seen timestamp waiting to be written to the database
+PENDING_KEY = 'last_seen:pending'
+FLUSH_LOCK_KEY = 'last_seen:flush'
+
+# Keeps the latest ARGV[2] timestamp of ARGV[1] user in KEYS[1] hash. Returns 1 if KEYS[2] flush lock expiring
+# in ARGV[3] seconds is taken, so the flush is to be scheduled, 0 if it is scheduled already
+_TOUCH = """
+local seen = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+if not seen or seen < tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+if redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[3]) then
+    return 1
+end
+return 0
+"""
+
+# Removes ARGV[i + 1] fields of the KEYS[1] hash still holding the ARGV[i + 2] timestamps written to the database,
+# the ones updated meanwhile are left for the next flush
+_REMOVE_WRITTEN = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return 0
+"""
+
+# Buffer of the process used while Redis is not available
+_local = {}
+_local_lock = threading.Lock()
+_local_flushed = monotonic()
+
+
+def touch(user_id: int) -> None:
+    """
+    Records that {user_id} is seen now: the latest time of each user is kept. The times are written to the database
+    by the flush_last_seen job scheduled by the first touch of each LAST_SEEN_FLUSH_INTERVAL to run when it ends
+    """
+
+    now = time()
+    interval = current_app.config['LAST_SEEN_FLUSH_INTERVAL']
+
+    try:
+        script = current_app.redis.register_script(_TOUCH)
+        if script(keys=[PENDING_KEY, FLUSH_LOCK_KEY], args=[user_id, repr(now), interval]):
+            # The job runs after the lock expires, so the times recorded while it is held are written by it
+            current_app.task_queue.enqueue_in(timedelta(seconds=interval), 'app.tasks.flush_last_seen')
+
+    except redis.exceptions.RedisError:
+        _touch_local(user_id, datetime.utcfromtimestamp(now), interval)
+
+
+def _touch_local(user_id: int, now: datetime, interval: int) -> None:
+    """Buffers the time in the process and writes the buffer when the interval has passed since the last write"""
+
+    global _local, _local_flushed
+    with _local_lock:
+        _local[user_id] = max(now, _local.get(user_id, now))
+        if monotonic() - _local_flushed < interval:
+            return None
+
+        pending, _local, _local_flushed = _local, {}, monotonic()
+
+    _write(pending)
+
+
+def flush() -> int:
+    """
+    Writes the buffered last seen times to the database with one batched UPDATE. The times are removed from the buffer
+    once written, so they are kept for the next flush if the database fails. Returns number of users
+    """
+
+    pending = current_app.redis.hgetall(PENDING_KEY)
+    if not pending:
+        return 0
+
+    _write({int(user_id): datetime.utcfromtimestamp(float(seen)) for user_id, seen in pending.items()})
+
+    script = current_app.redis.register_script(_REMOVE_WRITTEN)
+    script(keys=[PENDING_KEY], args=[value for item in pending.items() for value in item])
+
+    return len(pending)
+
+
+def _write(pending: dict) -> None:
+    if not pending:
+        return None
+
+    update = User.__table__.update().where(User.id == db.bindparam('user_id')).values(
+        last_seen=db.bindparam('seen'))
+    with db.engine.begin() as connection:
+        connection.execute(update, [{'user_id': user_id, 'seen': seen} for user_id, seen in sorted(pending.items())])
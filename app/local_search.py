@@ -0,0 +1,112 @@
+import json
+import re
+import sqlite3
+from contextlib import contextmanager
+
+# Words of the search string: each one is matched as a quoted term, so FTS5 query syntax is never interpreted
+_WORD = re.compile(r'\w+')
+_INDEX_NAME = re.compile(r'^[\w-]+$')
+
+
+class LocalSearchBackend:
+    """
+    Built-in full-text search engine for the nodes running without Elasticsearch.
+    Every index is an SQLite FTS5 table in the {path} database file, search results are ranked by BM25
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _transaction(self, write=True):
+        """
+        Yields connection to the index database within a transaction: writers are serialized, readers are not
+        blocked. Connections are not shared by threads
+        """
+
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _table(index: str) -> str:
+        if not _INDEX_NAME.match(index):
+            raise ValueError(f'Invalid index name: {index}')
+
+        return f'"{index}"'
+
+    def _create_table(self, connection, index: str) -> None:
+        connection.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {self._table(index)} USING '
+                           f'fts5(content, source UNINDEXED, tokenize="unicode61 remove_diacritics 2")')
+
+    @staticmethod
+    def _row(id: int, payload: dict) -> tuple:
+        """Returns (rowid, searchable text, stored document) row for the entry, only text fields are searchable"""
+
+        content = ' '.join(str(value) for value in payload.values() if isinstance(value, str))
+
+        return id, content, json.dumps(payload, default=str)
+
+    def index(self, index: str, id: int, payload: dict) -> None:
+        self.bulk(index, [('index', id, payload)])
+
+    def delete(self, index: str, id: int) -> None:
+        self.bulk(index, [('delete', id, None)])
+
+    def bulk(self, index: str, actions: list) -> set:
+        """Applies (operation, id, payload) {actions} in one transaction. Returns ids of the failed actions"""
+
+        table = self._table(index)
+        with self._transaction() as connection:
+            self._create_table(connection, index)
+            connection.executemany(f'DELETE FROM {table} WHERE rowid = ?', [(id,) for _, id, _ in actions])
+            connection.executemany(f'INSERT INTO {table} (rowid, content, source) VALUES (?, ?, ?)',
+                                   [self._row(id, payload) for operation, id, payload in actions
+                                    if operation == 'index'])
+
+        return set()
+
+    def query(self, index: str, string_to_search: str, page_number: int, objects_per_page: int,
+              fields=None) -> (list, int):
+        """
+        Returns (id, stored fields) pairs of the entries matching any word of {string_to_search} ranked by BM25 and
+        their number. All the text fields are searched whatever {fields} are
+        """
+
+        words = _WORD.findall(string_to_search)
+        if not words:
+            return [], 0
+
+        match = ' OR '.join(f'"{word}"' for word in words)
+        table = self._table(index)
+        with self._transaction(write=False) as connection:
+            if not connection.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (index,)).fetchone():
+                return [], 0
+
+            hits = [(id, json.loads(source).get('stored')) for id, source in connection.execute(
+                f'SELECT rowid, source FROM {table} WHERE {table} MATCH ? ORDER BY bm25({table}) LIMIT ? OFFSET ?',
+                (match, objects_per_page, (page_number - 1) * objects_per_page))]
+            total = connection.execute(f'SELECT count(*) FROM {table} WHERE {table} MATCH ?', (match,)).fetchone()[0]
+
+        return hits, total
+
+    def create_index(self, index: str) -> None:
+        with self._transaction() as connection:
+            connection.execute(f'DROP TABLE IF EXISTS {self._table(index)}')
+            self._create_table(connection, index)
+
+    def swap_alias(self, alias: str, new_index: str) -> None:
+        """Atomically replaces the {alias} index with {new_index}"""
+
+        with self._transaction() as connection:
+            connection.execute(f'DROP TABLE IF EXISTS {self._table(alias)}')
+            connection.execute(f'ALTER TABLE {self._table(new_index)} RENAME TO {self._table(alias)}')
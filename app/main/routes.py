@@ -1,17 +1,17 @@
-from datetime import datetime
-from langdetect import detect, LangDetectException
-from flask import render_template, flash, redirect, url_for, request, jsonify
+from redis.exceptions import RedisError
+from flask import render_template, flash, redirect, url_for, request, jsonify, Response, abort, send_from_directory
 from flask_login import current_user, login_required
 from flask_babel import _
 from flask import g
 from flask_babel import get_locale
 from flask import current_app as app
 
-from app import db
+from app import db, export, last_seen, push, timeline
 from app.main import bp
 from app.main.forms import EditProfileForm, SubmitForm, PostForm, SearchForm
-from app.models import User, Post, Notification
-from app.translate import translate
+from app.models import User, Post, PostTranslation
+from app.pagination import paginate_keyset
+from app.translate import TranslationError, translate
 
 
 @bp.route('/', methods=['GET', 'POST'])
@@ -23,22 +23,24 @@ def index():
     form = PostForm()
     if form.validate_on_submit():
 
-        try:
-            language = detect(form.text.data)
-        except LangDetectException:
-            language = ''
-
-        post = Post(body=form.text.data, user_id=current_user.id, language=language)
+        # Language is detected by the worker
+        post = Post(body=form.text.data, user_id=current_user.id, language='')
         db.session.add(post)
         db.session.commit()
 
-    page = request.args.get('page', 1, type=int)
-    posts = current_user.get_posts_from_followed_users().paginate(page, app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.index', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) if posts.has_prev else None
+        # Author sees the post at once, followers get it from the fan-out job
+        try:
+            timeline.add_posts([current_user.id], [(post.id, post.timestamp)])
+        except RedisError:
+            pass
+
+    posts = current_user.get_timeline(app.config['POSTS_PER_PAGE'], request.args.get('before'),
+                                      request.args.get('after'))
+    next_url = url_for('main.index', before=posts.next_cursor) if posts.next_cursor else None
+    prev_url = url_for('main.index', after=posts.prev_cursor) if posts.prev_cursor else None
 
     return render_template('main/index.html', title=_('Home'), posts=posts.items, form=form, next_url=next_url,
-                           prev_url=prev_url)
+                           prev_url=prev_url, translations=_get_translations(posts.items))
 
 
 @bp.route('/explore')
@@ -46,24 +48,76 @@ def index():
 def explore():
     """Explore Page: displays posts from all the users paginated and ordered by timestamp"""
 
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.timestamp.desc()).paginate(page, app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.explore', page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.explore', page=posts.prev_num) if posts.has_prev else None
+    posts = paginate_keyset(Post.eager_load(Post.query), [Post.timestamp, Post.id], app.config['POSTS_PER_PAGE'],
+                            request.args.get('before'), request.args.get('after'))
+    next_url = url_for('main.explore', before=posts.next_cursor) if posts.next_cursor else None
+    prev_url = url_for('main.explore', after=posts.prev_cursor) if posts.prev_cursor else None
 
     return render_template('main/index.html', title=_('Explore'), posts=posts.items, next_url=next_url,
-                           prev_url=prev_url)
+                           prev_url=prev_url, translations=_get_translations(posts.items))
+
+
+def _get_translations(posts: list) -> dict:
+    """Counts views of the page {posts} and returns their stored translations into the user's language"""
+
+    Post.record_views(posts, g.locale)
+
+    return PostTranslation.get_stored([post.id for post in posts if post.language and post.language != g.locale],
+                                      g.locale)
 
 
 @bp.route('/translate', methods=['POST'])
 @login_required
 def translate_post():
-    """View for posts translation. Returns {'text': <translated text>} dictionary"""
+    """
+    View for posts translation. Returns {'text': <translated text>} dictionary.
+    Translation of a post given by 'post_id' is read from the store or stored once translated.
+    Only the LANGUAGES of the application are accepted as 'destination_language'
+    """
+
+    if request.form.get('destination_language') not in app.config['LANGUAGES']:
+        abort(400)
+
+    post = Post.query.get(request.form['post_id']) if request.form.get('post_id', type=int) else None
+    if post is None:
+        return jsonify({
+            'text': translate(request.form['text_to_translate'], request.form['source_language'],
+                              request.form['destination_language'])
+        })
+
+    try:
+        translations = PostTranslation.translate_posts([post], request.form['destination_language'])
+    except TranslationError as error:
+        return jsonify({'text': str(error)})
+    db.session.commit()
+
+    return jsonify({'text': translations.get(post.id, post.body)})
+
+
+@bp.route('/translate/batch', methods=['POST'])
+@login_required
+def translate_posts():
+    """
+    View for translation of all the posts on a page. Takes {'posts': [<post id>, ...], 'destination_language': ...}
+    JSON, returns {'translations': {<post id>: <translated text>}} dictionary. Nothing is translated into a language
+    missing in the LANGUAGES of the application
+    """
+
+    data = request.get_json(silent=True) or {}
+    destination_language = data.get('destination_language')
+    ids = [id for id in data.get('posts', []) if isinstance(id, int)][:100]
+    if destination_language not in app.config['LANGUAGES'] or not ids:
+        return jsonify({'translations': {}})
+
+    try:
+        translations = PostTranslation.translate_posts(Post.query.filter(Post.id.in_(ids)).all(), destination_language)
+    except TranslationError as error:
+        # Translations from the other languages received before the error are kept
+        db.session.commit()
+        return jsonify({'translations': {}, 'error': str(error)})
+    db.session.commit()
 
-    return jsonify({
-        'text': translate(request.form['text_to_translate'], request.form['source_language'],
-                          request.form['destination_language'])
-    })
+    return jsonify({'translations': translations})
 
 
 @bp.route('/user_profile/<username>')
@@ -72,14 +126,16 @@ def user_profile(username):
     """User Profile Page: displays common info of the user"""
 
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    posts = user.posts.paginate(page, app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('main.user_profile', username=user.username, page=posts.next_num) if posts.has_next else None
-    prev_url = url_for('main.user_profile', username=user.username, page=posts.prev_num) if posts.has_prev else None
+    posts = paginate_keyset(Post.eager_load(user.posts), [Post.timestamp, Post.id], app.config['POSTS_PER_PAGE'],
+                            request.args.get('before'), request.args.get('after'))
+    next_url = url_for('main.user_profile', username=user.username,
+                       before=posts.next_cursor) if posts.next_cursor else None
+    prev_url = url_for('main.user_profile', username=user.username,
+                       after=posts.prev_cursor) if posts.prev_cursor else None
     form = SubmitForm()
 
     return render_template('main/user_profile.html', title=_('User Profile'), user=user, posts=posts.items, form=form,
-                           prev_url=prev_url, next_url=next_url)
+                           prev_url=prev_url, next_url=next_url, translations=_get_translations(posts.items))
 
 
 @bp.route('/edit_profile', methods=['GET', 'POST'])
@@ -172,8 +228,8 @@ def search():
     if page > 1:
         prev_url = url_for('main.search', text=g.search_form.text.data, page=page - 1)
 
-    return render_template('main/search.html', title=_('Search'), posts=posts.all(),
-                           next_url=next_url, prev_url=prev_url)
+    return render_template('main/search.html', title=_('Search'), posts=posts,
+                           next_url=next_url, prev_url=prev_url, translations=_get_translations(posts))
 
 
 @bp.route('/user_profile/<username>/popup')
@@ -192,41 +248,84 @@ def user_popup(username):
 def notifications():
     """Returns notifications for the user: displays income messages number in real time"""
 
-    since = request.args.get('since', 0.0, type=float)
-    notifications = current_user.notifications.filter(
-        Notification.timestamp > since).order_by(Notification.timestamp.asc())
+    return jsonify(current_user.get_notifications(request.args.get('since', 0.0, type=float)))
+
+
+@bp.route('/notifications/stream')
+@login_required
+def notifications_stream():
+    """
+    Pushes notifications for the user as Server-Sent Events. Responds with 503 when streams are disabled, the worker
+    has no free stream slots or Redis is not available: the page falls back to polling /notifications then
+    """
+
+    if not app.config['NOTIFICATION_STREAMS_PER_WORKER']:
+        return jsonify({'error': 'notification streams are disabled'}), 503
+
+    if not push.acquire_stream():
+        return jsonify({'error': 'too many streams'}), 503
+
+    try:
+        # Subscribed before reading the missed notifications, so nothing published in between is lost
+        pubsub = push.subscribe(current_user.id)
+    except RedisError:
+        push.release_stream()
+        return jsonify({'error': 'notifications stream is not available'}), 503
+
+    # Reconnecting browser sends the id of the last received event
+    since = request.headers.get('Last-Event-ID', type=float) or request.args.get('since', 0.0, type=float)
+    backlog = current_user.get_notifications(since)
 
-    return jsonify([
-        {
-            'name': notification.name,
-            'data': notification.get_data(),
-            'timestamp': notification.timestamp
-        } for notification in notifications
-    ])
+    response = Response(push.stream(pubsub, backlog, app.config['NOTIFICATION_STREAM_HEARTBEAT'],
+                                    app.config['NOTIFICATION_STREAM_TIMEOUT']),
+                        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(pubsub.close)
+    response.call_on_close(push.release_stream)
+
+    return response
 
 
 @bp.route('/export_posts')
 @login_required
 def export_posts():
-    """Exports posts for a user and sends to the email"""
+    """Exports posts for a user and sends to the email. Takes 'format' (json, ndjson, csv) and 'gzip' arguments"""
+
+    export_format = request.args.get('format', 'json')
+    if export_format not in export.FORMATS:
+        export_format = 'json'
 
     if current_user.get_task_in_progress('export_posts'):
         flash(_('An export task is currently in progress'))
     else:
-        current_user.launch_task('export_posts', _('Exporting posts...'))
+        compress = bool(request.args.get('gzip', 0, type=int))
+        # The worker has no request to build the link from, so it is built here
+        filename = export.new_filename(current_user.id, export_format, compress)
+        current_user.launch_task('export_posts', _('Exporting posts...'), export_format, compress, filename,
+                                 url_for('main.download_export', filename=filename, _external=True))
         db.session.commit()
 
     return redirect(url_for('main.user_profile', username=current_user.username))
 
 
+@bp.route('/exports/<filename>')
+@login_required
+def download_export(filename: str):
+    """Sends the exported posts file of the user streaming it from the disk"""
+
+    if not export.is_owner(filename, current_user.id):
+        abort(404)
+
+    return send_from_directory(app.config['EXPORT_PATH'], filename, as_attachment=True,
+                               download_name=export.get_download_name(filename))
+
+
 @bp.before_request
 def before_request():
     """Sets last seen date, local dates and search form for the user before the page request"""
 
-    # Sets last_seen date
+    # Sets last_seen date: it is buffered and written to the database in batches
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.touch(current_user.id)
         g.search_form = SearchForm()
 
     # Sets locale for dates on pages
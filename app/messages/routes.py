@@ -1,4 +1,3 @@
-from datetime import datetime
 from flask import flash, redirect, url_for, render_template, request
 from flask_login import current_user, login_required
 from flask_babel import _
@@ -8,6 +7,7 @@ from app import db
 from app.messages import bp
 from app.messages.forms import MessageForm
 from app.models import User, Message
+from app.pagination import paginate_keyset
 
 
 @bp.route('/send_message/<recipient>', methods=['GET', 'POST'])
@@ -20,8 +20,11 @@ def send_message(recipient):
 
     if form.validate_on_submit():
         msg = Message(author=current_user, recipient=user, body=form.message.data)
-        user.add_notification('unread_message_count', user.new_messages())
         db.session.add(msg)
+        db.session.flush()
+        # Counter is incremented in the database by the insert
+        db.session.expire(user, ['unread_message_count'])
+        user.add_notification('unread_message_count', user.new_messages())
         db.session.commit()
         flash(_('Your message has been sent.'))
         return redirect(url_for('main.user_profile', username=recipient))
@@ -34,21 +37,21 @@ def send_message(recipient):
 def messages():
     """Messages View: displays messages of and for the current user"""
 
-    current_user.last_message_read_time = datetime.utcnow()
+    current_user.read_messages()
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
-    page = request.args.get('page', 1, type=int)
-    messages = current_user.messages_received.order_by(Message.timestamp.desc()).paginate(
-        page, app.config['POSTS_PER_PAGE'], False)
+    messages = paginate_keyset(current_user.messages_received.options(db.joinedload(Message.author)),
+                               [Message.timestamp, Message.id], app.config['POSTS_PER_PAGE'],
+                               request.args.get('before'), request.args.get('after'))
 
     next_url = None
     prev_url = None
 
-    if messages.has_next:
-        next_url = url_for('messages.messages', page=messages.next_num)
+    if messages.next_cursor:
+        next_url = url_for('messages.messages', before=messages.next_cursor)
 
-    if messages.has_prev:
-        prev_url = url_for('messages.messages', page=messages.prev_num)
+    if messages.prev_cursor:
+        prev_url = url_for('messages.messages', after=messages.prev_cursor)
 
     return render_template('messages/messages.html', title=_('Messages'), messages=messages.items, next_url=next_url,
                            prev_url=prev_url)
@@ -1,83 +1,108 @@
 from flask import url_for
 
 from app import db
-from app.search import add_to_index, remove_from_index, query_index
+from app.pagination import paginate_keyset
+from app.search import get_payload, index_chunks, query_index_documents, reindex
 
 
 class SearchableMixin:
-    """Mixin performing elasticsearch"""
+    """
+    Mixin performing full-text search. Models setting __hydrate__ store the fields needed for rendering in the
+    index documents and get search results built from the index without querying the database: they define
+    get_stored_fields() returning the JSON-serializable fields and from_stored_fields(id, stored) classmethod
+    building read-only result objects of them
+    """
+
+    __hydrate__ = False
 
     @classmethod
-    def search(cls, string_to_search: str, page_number: int, objects_per_page: int):
-        """Searches for {string_to_search} and returns model instances of the search result paginated"""
+    def search(cls, string_to_search: str, page_number: int, objects_per_page: int) -> (list, int):
+        """Searches for {string_to_search} and returns objects of the search result page and total number of results"""
+
+        hits, total = query_index_documents(cls.__tablename__, string_to_search, page_number, objects_per_page,
+                                            cls.__searchable__)
+        if not hits:
+            return [], total
+
+        if cls.__hydrate__ and all(stored for id, stored in hits):
+            return [cls.from_stored_fields(id, stored) for id, stored in hits], total
 
-        ids, total = query_index(cls.__tablename__, string_to_search, page_number, objects_per_page)
-        if not total:
-            return cls.query.filter_by(id=0), 0
+        # Documents indexed before hydration was enabled: the objects are loaded from the database
+        ids = [id for id, stored in hits]
         when = [(ids[i], i) for i in range(len(ids))]
 
-        return cls.query.filter(cls.id.in_(ids)).order_by(db.case(when, value=cls.id)), total
+        return cls.eager_load(cls.query.filter(cls.id.in_(ids)).order_by(db.case(when, value=cls.id))).all(), total
 
     @classmethod
-    def before_commit(cls, session) -> None:
-        """Saves changes to update the Elasticsearch index later"""
+    def eager_load(cls, query):
+        """Adds loading of the objects' relationships rendered with search results to {query}"""
 
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+        return query
 
     @classmethod
-    def after_commit(cls, session) -> None:
-        """Updates the Elasticsearch index"""
-
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
+    def reindex(cls, chunk_size=1000, workers=4, new_index=False, resume=False, on_progress=None) -> int:
+        """
+        Refreshes an index with all the data from the model: rows are read in id ranges of {chunk_size} and sent
+        with the bulk API by {workers} threads. See search.reindex for {new_index} and {resume}
+        """
 
-        for obj in session._changes['update']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
+        return reindex(cls.__tablename__, lambda after_id: cls._read_index_chunks(after_id, chunk_size), workers,
+                       new_index, resume, on_progress)
 
-        for obj in session._changes['delete']:
-            if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
+    @classmethod
+    def index_after(cls, after_id: int, chunk_size=1000, workers=4, on_progress=None) -> int:
+        """
+        Sends the rows with ids greater than {after_id} to the index, read in id ranges of {chunk_size} by {workers}
+        threads. A reindex running meanwhile is neither interrupted nor missing the rows. See search.index_chunks
+        """
 
-        session._changes = None
+        return index_chunks(cls.__tablename__, cls._read_index_chunks(after_id, chunk_size), workers, on_progress)
 
     @classmethod
-    def reindex(cls) -> None:
-        """Refreshes an index with all the data from the model"""
+    def _read_index_chunks(cls, after_id: int, chunk_size: int):
+        """Yields (last id, index actions) pairs of the rows with ids greater than {after_id} by {chunk_size}"""
+
+        while True:
+            objects = cls.eager_load(cls.query.filter(cls.id > after_id)).order_by(cls.id).limit(chunk_size).all()
+            if not objects:
+                return None
 
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+            after_id = objects[-1].id
+            actions = [('index', obj.id, get_payload(obj)) for obj in objects]
+            db.session.expunge_all()
+            yield after_id, actions
 
 
 class PaginatedAPIMixin(object):
     """Mixin for API pagination"""
 
-    @staticmethod
-    def to_collection_dict(query, page_number: int, objects_per_page: int, endpoint: str, full_path=False,
-                           **kwargs) -> dict:
-        """Returns dictionary for API with data paginated"""
-
-        resources = query.paginate(page_number, objects_per_page, False)
+    @classmethod
+    def to_collection_dict(cls, query, objects_per_page: int, endpoint: str, before=None, after=None,
+                           include_total=False, full_path=False, **kwargs) -> dict:
+        """
+        Returns dictionary for API with data paginated by id cursors: {before} cursor gives the next page,
+        {after} the previous one. Total number of items is counted only if {include_total} is set
+        """
+
+        resources = paginate_keyset(query, [cls.id], objects_per_page, before, after)
         data = {
             'items': [item.to_dict() for item in resources.items],
             '_meta': {
-                'page': page_number,
                 'per_page': objects_per_page,
-                'total_pages': resources.pages,
-                'total_items': resources.total
+                'next_cursor': resources.next_cursor,
+                'prev_cursor': resources.prev_cursor
             },
             '_links': {
-                'self': url_for(endpoint, _external=full_path, page=page_number, per_page=objects_per_page, **kwargs),
-                'next': url_for(endpoint, _external=full_path, page=page_number + 1, per_page=objects_per_page,
-                                **kwargs) if resources.has_next else None,
-                'prev': url_for(endpoint, _external=full_path, page=page_number - 1, per_page=objects_per_page,
-                                **kwargs) if resources.has_prev else None,
+                'self': url_for(endpoint, _external=full_path, before=before, after=after, per_page=objects_per_page,
+                                **kwargs),
+                'next': url_for(endpoint, _external=full_path, before=resources.next_cursor,
+                                per_page=objects_per_page, **kwargs) if resources.next_cursor else None,
+                'prev': url_for(endpoint, _external=full_path, after=resources.prev_cursor,
+                                per_page=objects_per_page, **kwargs) if resources.prev_cursor else None,
             }
         }
 
+        if include_total:
+            data['_meta']['total_items'] = query.order_by(None).count()
+
         return data
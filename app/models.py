@@ -1,6 +1,7 @@
 import base64
 import json
 import os
+from collections import Counter
 from typing import Any
 
 import jwt
@@ -9,24 +10,61 @@ import rq
 from flask_login import UserMixin
 from flask import current_app as app, url_for
 from flask_sqlalchemy import BaseQuery
+from rq import Retry
 from rq.job import Job
+from sqlalchemy.dialects import postgresql, sqlite
 from werkzeug.security import generate_password_hash, check_password_hash
 from hashlib import md5
 from datetime import datetime, timedelta
-from time import time
+from time import monotonic, time
 
-from app import db, login
+from app import db, login, api_tokens, follow_graph, jobs, notification_store, push, timeline
 from app.mixins import SearchableMixin, PaginatedAPIMixin
-
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
-db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+from app.pagination import KeysetPage, decode_cursor, paginate_keyset
+from app.translate import translate_texts
+
+db.event.listen(db.session, 'after_commit', jobs.after_commit)
+db.event.listen(db.session, 'after_rollback', jobs.after_rollback)
+db.event.listen(db.session, 'after_commit', push.after_commit)
+db.event.listen(db.session, 'after_rollback', push.after_rollback)
+db.event.listen(db.session, 'after_commit', api_tokens.after_commit)
+db.event.listen(db.session, 'after_rollback', api_tokens.after_rollback)
+db.event.listen(db.session, 'after_commit', follow_graph.after_commit)
+db.event.listen(db.session, 'after_rollback', follow_graph.after_rollback)
 
 followers = db.Table('followers',
-                     db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-                     db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+                     db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                     db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                     # Followers of a user, the primary key serves the followed users
+                     db.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id')
                      )
 
 
+def insert_ignoring_duplicates(table):
+    """Returns INSERT statement into {table} skipping the rows which already exist under its primary or unique keys"""
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+
+    return table.insert().prefix_with('IGNORE')
+
+
+def execute_many(statement, rows: list, page_size=1000) -> int:
+    """
+    Executes {statement} for the {rows} parameter sets in executemany batches of {page_size}: psycopg2 reports
+    the affected rows of its last page of 1000 rows only. Returns number of the affected rows
+    """
+
+    affected = 0
+    for i in range(0, len(rows), page_size):
+        affected += db.session.execute(statement, rows[i:i + page_size]).rowcount
+
+    return affected
+
+
 class Notification(db.Model):
     """Model for notifications"""
 
@@ -36,10 +74,92 @@ class Notification(db.Model):
     timestamp = db.Column(db.Float, index=True, default=time)
     payload_json = db.Column(db.Text)
 
+    __table_args__ = (db.Index('ix_notification_user_id_timestamp', 'user_id', 'timestamp'),)
+
     def get_data(self) -> Any:
         return json.loads(str(self.payload_json))
 
 
+def get_avatar_url(digest: str, size: int) -> str:
+    """Returns avatar url by {digest} of the email address"""
+
+    return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+
+
+class SearchOutbox(db.Model):
+    """Model for search index changes committed but not sent to the search backend yet"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    index = db.Column(db.String(64))
+    object_id = db.Column(db.Integer)
+    operation = db.Column(db.String(8))
+    timestamp = db.Column(db.Float, index=True, default=time)
+
+    @staticmethod
+    def after_flush(session, flush_context) -> None:
+        """Writes index changes of the flushed searchable objects to the outbox within the same transaction"""
+
+        if not app.search_backend:
+            return None
+
+        changes = []
+        for obj in session.new:
+            if isinstance(obj, SearchableMixin):
+                changes.append({'index': obj.__tablename__, 'object_id': obj.id, 'operation': 'index'})
+
+        for obj in session.dirty:
+            if isinstance(obj, SearchableMixin):
+                state = db.inspect(obj)
+                fields = [attr.key for attr in state.mapper.column_attrs] if obj.__hydrate__ else obj.__searchable__
+                if any(state.attrs[field].history.has_changes() for field in fields):
+                    changes.append({'index': obj.__tablename__, 'object_id': obj.id, 'operation': 'index'})
+
+            elif isinstance(obj, User) and Post.__hydrate__ and any(
+                    db.inspect(obj).attrs[field].history.has_changes() for field in ('username', 'email')):
+                # Posts store author's username and avatar hash in the index documents
+                session.connection().execute(SearchOutbox.__table__.insert().from_select(
+                    ['index', 'object_id', 'operation', 'timestamp'],
+                    db.select(db.literal(Post.__tablename__), Post.id, db.literal('index'), db.literal(time()))
+                    .where(Post.user_id == obj.id)))
+                jobs.enqueue_after_commit(session, 'index_search_outbox',
+                                          retry=Retry(max=5, interval=[10, 30, 60, 300]))
+
+        for obj in session.deleted:
+            if isinstance(obj, SearchableMixin):
+                changes.append({'index': obj.__tablename__, 'object_id': obj.id, 'operation': 'delete'})
+
+        if changes:
+            SearchOutbox.add_changes(session, changes)
+
+    @staticmethod
+    def add_changes(session, changes: list[dict]) -> None:
+        """
+        Writes {changes} made outside the ORM unit of work to the outbox within the {session} transaction.
+        Changes are sent once the transaction is committed
+        """
+
+        if not app.search_backend or not changes:
+            return None
+
+        session.connection().execute(SearchOutbox.__table__.insert(), changes)
+        jobs.enqueue_after_commit(session, 'index_search_outbox', retry=Retry(max=5, interval=[10, 30, 60, 300]))
+
+    @staticmethod
+    def get_lag() -> dict:
+        """Returns number of pending index changes and age of the oldest one in seconds"""
+
+        pending, oldest = db.session.query(db.func.count(SearchOutbox.id), db.func.min(SearchOutbox.timestamp)).one()
+
+        return {'pending': pending, 'lag': time() - oldest if oldest else 0.0}
+
+
+db.event.listen(db.session, 'after_flush', SearchOutbox.after_flush)
+
+
+# Cached task banners of the users: user id -> (expiry time, banner)
+_task_banners = {}
+
+
 class Task(db.Model):
     """Model for tasks"""
 
@@ -49,6 +169,8 @@ class Task(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     complete = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (db.Index('ix_task_user_id_complete', 'user_id', 'complete'),)
+
     def get_rq_job(self) -> Job:
         """Gets Job instance by task id. Returns None in case the job has been already finished"""
 
@@ -65,6 +187,26 @@ class Task(db.Model):
         job = self.get_rq_job()
         return job.meta.get('progress', 0) if job else 100
 
+    @staticmethod
+    def get_progress_many(tasks: list) -> dict:
+        """Returns progress percentages of {tasks} by task ids fetching all the jobs in one Redis round trip"""
+
+        if not tasks:
+            return {}
+
+        try:
+            jobs = Job.fetch_many([task.id for task in tasks], connection=app.redis)
+        except redis.exceptions.RedisError:
+            jobs = [None] * len(tasks)
+
+        return {task.id: job.meta.get('progress', 0) if job else 100 for task, job in zip(tasks, jobs)}
+
+    def set_complete(self) -> None:
+        """Marks the task complete and drops the task banner of its user cached in the process"""
+
+        self.complete = True
+        _task_banners.pop(self.user_id, None)
+
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
     """Model for User"""
@@ -91,6 +233,10 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     tasks = db.relationship('Task', backref='user', lazy='dynamic')
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime)
+    post_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    unread_message_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     def set_password(self, password: str) -> None:
         """Generates password hash for input password"""
@@ -102,28 +248,202 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
         return check_password_hash(self.password_hash, password)
 
+    def get_avatar_hash(self) -> str:
+        """Returns digest of the email address identifying avatar of the user"""
+
+        return md5(self.email.lower().encode('utf-8')).hexdigest()
+
     def get_avatar(self, size=80) -> str:
         """Returns avatar url by email address of the user"""
 
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        return get_avatar_url(self.get_avatar_hash(), size)
 
     def follow(self, user_to_follow) -> None:
-        """Makes current user follow {user_to_follow}"""
+        """Makes current user follow {user_to_follow}: nothing is changed if the user is followed already"""
 
-        if not self.is_following(user_to_follow):
-            self.followed.append(user_to_follow)
+        # Core statements do not flush the session: users added within the transaction get their ids first
+        db.session.flush()
+        inserted = db.session.execute(insert_ignoring_duplicates(followers).values(
+            follower_id=self.id, followed_id=user_to_follow.id)).rowcount
+        if inserted:
+            self._update_follow_counters(user_to_follow, 1)
+            follow_graph.change_after_commit(db.session, self.id, user_to_follow.id, True)
+            jobs.enqueue_after_commit(db.session, 'add_followed_to_timeline', self.id, user_to_follow.id)
 
     def unfollow(self, user_to_unfollow) -> None:
         """Makes current user unfollow {user_to_follow}"""
 
-        if self.is_following(user_to_unfollow):
-            self.followed.remove(user_to_unfollow)
+        db.session.flush()
+        deleted = db.session.execute(followers.delete().where(
+            followers.c.follower_id == self.id, followers.c.followed_id == user_to_unfollow.id)).rowcount
+        if deleted:
+            self._update_follow_counters(user_to_unfollow, -1)
+            follow_graph.change_after_commit(db.session, self.id, user_to_unfollow.id, False)
+            jobs.enqueue_after_commit(db.session, 'remove_followed_from_timeline', self.id, user_to_unfollow.id)
+
+    def _update_follow_counters(self, followed_user, delta: int) -> None:
+        """Changes followed counter of the current user and follower counter of {followed_user} by {delta}"""
+
+        db.session.execute(User.__table__.update().where(User.id == self.id).values(
+            followed_count=User.followed_count + delta))
+        db.session.execute(User.__table__.update().where(User.id == followed_user.id).values(
+            follower_count=User.follower_count + delta))
+
+    @staticmethod
+    def import_follows(edges, chunk_size=1000) -> int:
+        """
+        Adds (follower id, followed id) {edges} inserting {chunk_size} of them at once. Duplicates, edges which exist
+        already, self follows and edges of the users which do not exist are skipped. Returns number of added edges
+        """
+
+        edges = {(int(follower_id), int(followed_id)) for follower_id, followed_id in edges
+                 if int(follower_id) != int(followed_id)}
+        user_ids = sorted({user_id for edge in edges for user_id in edge})
+        existing_user_ids = set()
+        for i in range(0, len(user_ids), chunk_size):
+            existing_user_ids.update(id for id, in db.session.query(User.id).filter(
+                User.id.in_(user_ids[i:i + chunk_size])))
+        edges = sorted(edge for edge in edges if edge[0] in existing_user_ids and edge[1] in existing_user_ids)
+
+        added = []
+        count = 0
+        raced_user_ids = set()
+        insert = insert_ignoring_duplicates(followers)
+        for i in range(0, len(edges), chunk_size):
+            chunk = edges[i:i + chunk_size]
+            existing = set(db.session.query(followers.c.follower_id, followers.c.followed_id).filter(
+                db.tuple_(followers.c.follower_id, followers.c.followed_id).in_(chunk)))
+            new_edges = [edge for edge in chunk if edge not in existing]
+            if not new_edges:
+                continue
+
+            inserted = execute_many(insert, [{'follower_id': follower_id, 'followed_id': followed_id}
+                                             for follower_id, followed_id in new_edges])
+            count += inserted
+            added.extend(new_edges)
+            if inserted != len(new_edges):
+                # Some edges were added concurrently after the check and counted by whoever added them: which ones
+                # is unknown, so the counters of the chunk's users are recounted instead of incremented
+                raced_user_ids.update(user_id for edge in new_edges for user_id in edge)
+
+        counted = [edge for edge in added if edge[0] not in raced_user_ids and edge[1] not in raced_user_ids]
+        followed_deltas = Counter(follower_id for follower_id, _ in counted)
+        follower_deltas = Counter(followed_id for _, followed_id in counted)
+        for counter, deltas in (('followed_count', followed_deltas), ('follower_count', follower_deltas)):
+            if deltas:
+                db.session.execute(User.__table__.update().where(User.id == db.bindparam('user_id')).values(
+                    {counter: getattr(User, counter) + db.bindparam('delta')}),
+                    [{'user_id': user_id, 'delta': delta} for user_id, delta in sorted(deltas.items())])
+        raced_user_ids = sorted(raced_user_ids)
+        for i in range(0, len(raced_user_ids), chunk_size):
+            User.recount(raced_user_ids[i:i + chunk_size])
+
+        # Edges added concurrently exist either way
+        for follower_id, followed_id in added:
+            follow_graph.change_after_commit(db.session, follower_id, followed_id, True)
+        for follower_id in sorted({follower_id for follower_id, _ in added}):
+            jobs.enqueue_after_commit(db.session, 'rebuild_timeline', follower_id)
+
+        return count
+
+    @staticmethod
+    def recount(user_ids=None) -> None:
+        """Recomputes post, follower, followed and unread message counters of {user_ids} users, all by default"""
+
+        update = User.__table__.update()
+        if user_ids is not None:
+            update = update.where(User.id.in_(user_ids))
+
+        db.session.execute(update.values(
+            post_count=db.select(db.func.count(Post.id)).where(Post.user_id == User.id).scalar_subquery(),
+            follower_count=db.select(db.func.count()).select_from(followers).where(
+                followers.c.followed_id == User.id).scalar_subquery(),
+            followed_count=db.select(db.func.count()).select_from(followers).where(
+                followers.c.follower_id == User.id).scalar_subquery(),
+            unread_message_count=db.select(db.func.count(Message.id)).where(
+                Message.recipient_id == User.id,
+                Message.timestamp > db.func.coalesce(User.last_message_read_time, datetime(1900, 1, 1))
+            ).scalar_subquery()
+        ))
+
+    @staticmethod
+    def follows(pairs: list[tuple[int, int]]) -> list[bool]:
+        """
+        Checks whether follower follows followed user for each (follower id, followed id) of {pairs} with one Redis
+        call. Sets of the users followed are loaded from the database when they are not materialized yet
+        """
+
+        try:
+            found = follow_graph.contains(pairs)
+            missing = {follower_id for (follower_id, _), value in zip(pairs, found) if value is None}
+            if missing:
+                # Edges changed by the current transaction are visible to it but may be rolled back: sets are only
+                # materialized from the committed ones
+                if follow_graph.get_pending(db.session):
+                    followed_ids = User._load_followed_ids(missing)
+                else:
+                    followed_ids = follow_graph.fill(missing, User._load_followed_ids)
+                found = [followed_id in followed_ids[follower_id] if value is None else value
+                         for (follower_id, followed_id), value in zip(pairs, found)]
+
+        except redis.exceptions.RedisError:
+            edges = set(db.session.query(followers.c.follower_id, followers.c.followed_id).filter(
+                followers.c.follower_id.in_({follower_id for follower_id, _ in pairs}),
+                followers.c.followed_id.in_({followed_id for _, followed_id in pairs})))
+            found = [pair in edges for pair in pairs]
+
+        # Changes of the current transaction are not in Redis until it is committed
+        pending = follow_graph.get_pending(db.session)
+
+        return [pending.get(pair, value) for pair, value in zip(pairs, found)]
+
+    @staticmethod
+    def _load_followed_ids(user_ids) -> dict[int, set]:
+        """Returns user id -> ids of the users followed mapping of {user_ids} read from the database"""
+
+        followed_ids = {user_id: set() for user_id in user_ids}
+        for follower_id, followed_id in db.session.query(followers.c.follower_id, followers.c.followed_id)\
+                .filter(followers.c.follower_id.in_(followed_ids)):
+            followed_ids[follower_id].add(followed_id)
 
-    def is_following(self, user_to_follow) -> int:
+        return followed_ids
+
+    def is_following(self, user_to_follow) -> bool:
         """Checks whether current user already follows {user_to_follow}"""
 
-        return self.followed.filter(followers.c.followed_id == user_to_follow.id).count()
+        return User.follows([(self.id, user_to_follow.id)])[0]
+
+    def is_mutual_follow(self, user) -> bool:
+        """Checks whether current user and {user} follow each other"""
+
+        return all(User.follows([(self.id, user.id), (user.id, self.id)]))
+
+    def get_followed_ids_among(self, user_ids: list[int]) -> set[int]:
+        """Returns ids of {user_ids} users current user follows"""
+
+        user_ids = list(user_ids)
+
+        return {user_id for user_id, following in zip(user_ids, User.follows([(self.id, id) for id in user_ids]))
+                if following}
+
+    @staticmethod
+    def rebuild_follow_graph(chunk_size=1000) -> int:
+        """Materializes sets of the users followed by every user reading {chunk_size} users at once"""
+
+        follow_graph.clear()
+        rebuilt = 0
+        after_id = 0
+
+        while True:
+            user_ids = [id for id, in db.session.query(User.id).filter(User.id > after_id).order_by(User.id).limit(
+                chunk_size)]
+            if not user_ids:
+                return rebuilt
+
+            follow_graph.fill(user_ids, User._load_followed_ids)
+
+            rebuilt += len(user_ids)
+            after_id = user_ids[-1]
 
     def get_posts_from_followed_users(self):
         """Gets posts from followed users + current user's own posts"""
@@ -134,6 +454,33 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
         return followed_posts.union(current_user_posts).order_by(Post.timestamp.desc())
 
+    def get_timeline(self, posts_per_page: int, before=None, after=None) -> KeysetPage:
+        """
+        Returns the home timeline page for {before} or {after} cursors.
+        Hydrates post ids from the materialized timeline, users following celebrities and cold timelines are
+        served by the database query
+        """
+
+        columns = [Post.timestamp, Post.id]
+        cursor = decode_cursor(before or after, columns) if before or after else None
+        newer = cursor is not None and not before
+
+        ids = None
+        celebrities = timeline.get_celebrities()
+        if not celebrities or not self.followed.filter(User.id.in_(celebrities)).first():
+            ids = timeline.get_page(self.id, posts_per_page, cursor, newer)
+
+        if ids is None:
+            return paginate_keyset(Post.eager_load(self.get_posts_from_followed_users()), columns, posts_per_page,
+                                   before, after)
+
+        posts = {post.id: post for post in Post.eager_load(Post.query.filter(Post.id.in_(ids)))}
+        rows = [posts[id] for id in ids if id in posts]
+        if newer and len(rows) <= posts_per_page:
+            return self.get_timeline(posts_per_page)
+
+        return KeysetPage.from_rows(rows, columns, posts_per_page, newer, cursor is not None)
+
     def generate_token_for_password_reset(self, expires_in=600) -> str:
         """Generates token for password reset"""
 
@@ -151,26 +498,57 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             return None
 
     def new_messages(self) -> int:
-        """Returns the number of unread messages the user has"""
+        """Returns the number of unread messages the user has: the counter is maintained on message insert"""
+
+        return self.unread_message_count
+
+    def read_messages(self) -> None:
+        """Marks all the received messages read"""
 
-        last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        return Message.query.filter_by(recipient=self).filter(Message.timestamp > last_read_time).count()
+        self.last_message_read_time = datetime.utcnow()
+        self.unread_message_count = 0
 
-    def add_notification(self, name: str, data: int) -> Notification:
-        """Returns notification for the unread message"""
+    def add_notification(self, name: str, data: int):
+        """
+        Replaces {name} notification of the user with the new {data} once committed. Notifications are kept in Redis
+        or, with 'sql' NOTIFICATION_BACKEND, in the database: the new Notification is returned then.
+        Notifications are pushed to the open notification streams
+        """
+
+        if app.config['NOTIFICATION_BACKEND'] != 'sql':
+            push.publish_after_commit(db.session, self.id, {'name': name, 'data': data})
+            return None
 
         self.notifications.filter_by(name=name).delete()
-        notification = Notification(name=name, payload_json=json.dumps(data), user=self)
+        notification = Notification(name=name, payload_json=json.dumps(data), user=self, timestamp=time())
         db.session.add(notification)
+        push.publish_after_commit(db.session, self.id, {'name': name, 'data': data,
+                                                        'timestamp': notification.timestamp})
 
         return notification
 
+    def get_notifications(self, since: float) -> list[dict]:
+        """Returns notifications of the user added after {since} timestamp ordered by timestamp"""
+
+        if app.config['NOTIFICATION_BACKEND'] != 'sql':
+            return notification_store.get_since(self.id, since)
+
+        return [
+            {
+                'name': notification.name,
+                'data': notification.get_data(),
+                'timestamp': notification.timestamp
+            } for notification in self.notifications.filter(
+                Notification.timestamp > since).order_by(Notification.timestamp.asc())
+        ]
+
     def launch_task(self, name: str, description: str, *args, **kwargs) -> Task:
         """Adds a task to the RQ queue and the database"""
 
         rq_job = app.task_queue.enqueue('app.tasks.' + name, self.id, *args, **kwargs)
         task = Task(id=rq_job.get_id(), name=name, description=description, user=self)
         db.session.add(task)
+        _task_banners.pop(self.id, None)
 
         return task
 
@@ -179,6 +557,29 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
         return Task.query.filter_by(user=self, complete=False).all()
 
+    def get_task_banner(self) -> list[dict]:
+        """
+        Returns id, description and progress of the tasks in progress shown on every page. The banner is cached in
+        the process for TASK_BANNER_TTL seconds or until a task of the user is launched or completed in the process:
+        later progress is pushed to the page by notifications
+        """
+
+        now = monotonic()
+        cached = _task_banners.get(self.id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        tasks = self.get_tasks_in_progress()
+        progress = Task.get_progress_many(tasks)
+        banner = [{'id': task.id, 'description': task.description, 'progress': progress[task.id]} for task in tasks]
+
+        if len(_task_banners) > 10000:
+            for user_id in [user_id for user_id, (expires, _) in list(_task_banners.items()) if expires <= now]:
+                _task_banners.pop(user_id, None)
+        _task_banners[self.id] = (now + app.config['TASK_BANNER_TTL'], banner)
+
+        return banner
+
     def get_task_in_progress(self, name: str) -> Task:
         """Gets specific task by its {name} not completed"""
 
@@ -192,9 +593,9 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             'username': self.username,
             'last_seen': self.last_seen.isoformat() + 'Z',
             'about_me': self.about_me,
-            'post_count': self.posts.count(),
-            'follower_count': self.followers.count(),
-            'followed_count': self.followed.count(),
+            'post_count': self.post_count,
+            'follower_count': self.follower_count,
+            'followed_count': self.followed_count,
             '_links': {
                 'self': url_for('api.get_user', _external=full_path, user_id=self.id),
                 'followers': url_for('api.get_followers', _external=full_path, user_id=self.id),
@@ -219,12 +620,20 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             self.set_password(data['password'])
 
     def get_token(self, expires_in=3600) -> str:
-        """Generates token for a user"""
+        """
+        Generates token for a user. With 'signed' API_TOKEN_TYPE a stateless signed token is returned,
+        otherwise a random one stored in the database
+        """
+
+        if app.config['API_TOKEN_TYPE'] == 'signed':
+            return api_tokens.generate_signed(self.id, expires_in)
 
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
 
+        if self.token:
+            api_tokens.invalidate_after_commit(db.session, self.token)
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
@@ -232,9 +641,15 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         return self.token
 
     def revoke_token(self) -> None:
-        """Makes token invalid"""
+        """Makes token invalid. With 'signed' API_TOKEN_TYPE all the signed tokens issued to the user are revoked"""
+
+        if app.config['API_TOKEN_TYPE'] == 'signed':
+            api_tokens.revoke_signed(self.id)
+            return None
 
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
+        if self.token:
+            api_tokens.invalidate_after_commit(db.session, self.token)
 
     @staticmethod
     def check_token(token):
@@ -246,6 +661,28 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
         return user
 
+    @staticmethod
+    def get_user_id_by_token(token: str):
+        """
+        Returns id of the user the {token} belongs to or None if it is invalid. Signed tokens are verified without
+        the database, ids of the users by stored tokens are cached until the tokens expire
+        """
+
+        if app.config['API_TOKEN_TYPE'] == 'signed':
+            return api_tokens.verify_signed(token)
+
+        user_id, generation = api_tokens.get_cached_user_id(token)
+        if user_id is not None:
+            return user_id
+
+        user = User.check_token(token)
+        if not user:
+            return None
+
+        api_tokens.cache_user_id(token, user.id, user.token_expiration, generation)
+
+        return user.id
+
     def __repr__(self):
         return f"{self.username}"
 
@@ -261,16 +698,178 @@ class Post(SearchableMixin, db.Model):
     """Model for user Posts"""
 
     __searchable__ = ['body']
+    __hydrate__ = True
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(256))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     language = db.Column(db.String(5))
+    translations = db.relationship('PostTranslation', backref='post', lazy='dynamic', cascade='all, delete-orphan')
+
+    __table_args__ = (db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),)
+
+    @classmethod
+    def eager_load(cls, query):
+        """Adds loading of the posts' authors to {query} in the same round trip"""
+
+        return query.options(db.joinedload(Post.author))
+
+    def get_stored_fields(self) -> dict:
+        """Returns fields of the post and its author rendered in search results"""
+
+        return {
+            'body': self.body,
+            'timestamp': self.timestamp.isoformat(),
+            'language': self.language,
+            'user_id': self.user_id,
+            'author': {'username': self.author.username, 'avatar_hash': self.author.get_avatar_hash()}
+        }
+
+    @classmethod
+    def from_stored_fields(cls, id: int, stored: dict):
+        """Builds read-only search result post from the {stored} fields of the index document"""
+
+        author = SearchResultAuthor(stored['user_id'], stored['author']['username'], stored['author']['avatar_hash'])
+
+        return SearchResultPost(id, stored['body'], datetime.fromisoformat(stored['timestamp']), stored['language'],
+                                author)
+
+    @staticmethod
+    def after_flush(session, flush_context) -> None:
+        """
+        Schedules fan-out of the new posts to the followers' timelines and language detection of the posts
+        saved with interim empty language
+        """
+
+        for obj in session.new:
+            if isinstance(obj, Post):
+                jobs.enqueue_after_commit(session, 'fan_out_post', obj.id)
+                if obj.language == '':
+                    jobs.enqueue_after_commit(session, 'detect_post_language', obj.id)
+
+    @staticmethod
+    def after_insert(mapper, connection, post) -> None:
+        """Increments posts counter of the author"""
+
+        connection.execute(User.__table__.update().where(User.id == post.user_id).values(
+            post_count=User.post_count + 1))
+
+    @staticmethod
+    def after_delete(mapper, connection, post) -> None:
+        """Decrements posts counter of the author"""
+
+        connection.execute(User.__table__.update().where(User.id == post.user_id).values(
+            post_count=User.post_count - 1))
+
+    @staticmethod
+    def record_views(posts: list, locale: str) -> None:
+        """
+        Counts views of the {posts} written not in {locale}. Posts reaching TRANSLATION_PREFETCH_VIEWS views are
+        queued for translation into all the supported languages
+        """
+
+        posts = [post for post in posts if post.language and post.language != locale]
+        if not posts:
+            return None
+
+        try:
+            pipeline = app.redis.pipeline(transaction=False)
+            for post in posts:
+                pipeline.incr(f'post:views:{post.id}')
+                pipeline.expire(f'post:views:{post.id}', 7 * 24 * 3600)
+            views = pipeline.execute()[::2]
+
+            for post, count in zip(posts, views):
+                if count == app.config['TRANSLATION_PREFETCH_VIEWS']:
+                    app.task_queue.enqueue('app.tasks.prefetch_translations', post.id)
+
+        except redis.exceptions.RedisError:
+            pass
+
+    def __repr__(self):
+        return f"Post {self.id} from user {self.user_id}"
+
+
+class PostTranslation(db.Model):
+    """Model for translations of the posts into the supported languages"""
+
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    locale = db.Column(db.String(5), primary_key=True)
+    body = db.Column(db.Text)
+
+    @staticmethod
+    def get_stored(post_ids: list[int], locale: str) -> dict:
+        """Returns stored translations of {post_ids} into {locale} by post ids"""
+
+        if not post_ids:
+            return {}
+
+        return dict(db.session.query(PostTranslation.post_id, PostTranslation.body).filter(
+            PostTranslation.post_id.in_(post_ids), PostTranslation.locale == locale))
+
+    @staticmethod
+    def translate_posts(posts: list, locale: str) -> dict:
+        """
+        Returns translations of the foreign {posts} into {locale} by post ids. Stored translations are read first,
+        the rest are sent to the translator grouped by source language and added to the session for the caller
+        to commit
+        """
+
+        posts = [post for post in posts if post.language and post.language != locale]
+        translations = PostTranslation.get_stored([post.id for post in posts], locale)
+
+        posts_by_language = {}
+        for post in posts:
+            if post.id not in translations:
+                posts_by_language.setdefault(post.language, []).append(post)
+
+        for language, language_posts in posts_by_language.items():
+            texts = translate_texts([post.body for post in language_posts], language, locale)
+            new_translations = {post.id: text for post, text in zip(language_posts, texts)}
+            translations.update(new_translations)
+
+            # Posts translated by a concurrent request are skipped
+            db.session.execute(insert_ignoring_duplicates(PostTranslation.__table__), [
+                {'post_id': post_id, 'locale': locale, 'body': text} for post_id, text in new_translations.items()])
+
+        return translations
+
+    def __repr__(self):
+        return f"Translation of post {self.post_id} into {self.locale}"
+
+
+class SearchResultAuthor:
+    """Read-only author of the post built from the search index document"""
+
+    def __init__(self, id: int, username: str, avatar_hash: str):
+        self.id = id
+        self.username = username
+        self.avatar_hash = avatar_hash
+
+    def get_avatar(self, size=80) -> str:
+        return get_avatar_url(self.avatar_hash, size)
+
+
+class SearchResultPost:
+    """Read-only post built from the search index document, rendered like Post"""
+
+    def __init__(self, id: int, body: str, timestamp: datetime, language: str, author: SearchResultAuthor):
+        self.id = id
+        self.body = body
+        self.timestamp = timestamp
+        self.language = language
+        self.user_id = author.id
+        self.author = author
 
     def __repr__(self):
         return f"Post {self.id} from user {self.user_id}"
 
 
+db.event.listen(db.session, 'after_flush', Post.after_flush)
+db.event.listen(Post, 'after_insert', Post.after_insert)
+db.event.listen(Post, 'after_delete', Post.after_delete)
+
+
 class Message(db.Model):
     """Model for private messages"""
 
@@ -278,7 +877,19 @@ class Message(db.Model):
     body = db.Column(db.String(256))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+
+    __table_args__ = (db.Index('ix_message_recipient_id_timestamp', 'recipient_id', 'timestamp'),)
+
+    @staticmethod
+    def after_insert(mapper, connection, message) -> None:
+        """Increments unread messages counter of the recipient"""
+
+        connection.execute(User.__table__.update().where(User.id == message.recipient_id).values(
+            unread_message_count=User.unread_message_count + 1))
 
     def __repr__(self):
         return f"Message {self.id} from user {self.sender_id} to user {self.recipient_id}"
+
+
+db.event.listen(Message, 'after_insert', Message.after_insert)
@@ -0,0 +1,58 @@
+import json
+from time import time
+
+import redis
+from flask import current_app
+
+# Sets ARGV[2] payload of ARGV[1] notification in the KEYS[1] hash with a version greater than any before.
+# Versions are microsecond timestamps, the stored value is '<version> <payload>'
+_STORE = """
+local version = math.floor(tonumber(ARGV[3]))
+local last = tonumber(redis.call('HGET', KEYS[1], '_version') or '0')
+if version <= last then
+    version = last + 1
+end
+version = string.format('%d', version)
+redis.call('HSET', KEYS[1], '_version', version, ARGV[1], version .. ' ' .. ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return version
+"""
+
+
+def _key(user_id: int) -> str:
+    return f'notifications:latest:{user_id}'
+
+
+def store(user_id: int, name: str, data) -> float:
+    """
+    Keeps {data} as the latest payload of {name} notification of {user_id} for NOTIFICATION_TTL seconds.
+    Returns timestamp of the notification: it is greater than the timestamps of all the previous ones of the user
+    """
+
+    script = current_app.redis.register_script(_STORE)
+    version = script(keys=[_key(user_id)], args=[name, json.dumps(data), time() * 1000000,
+                                                 current_app.config['NOTIFICATION_TTL']])
+
+    return int(version) / 1000000
+
+
+def get_since(user_id: int, since: float) -> list[dict]:
+    """Returns the latest notifications of {user_id} stored after {since} timestamp ordered by timestamp"""
+
+    try:
+        values = current_app.redis.hgetall(_key(user_id))
+    except redis.exceptions.RedisError:
+        return []
+
+    since = round(since * 1000000)
+    notifications = []
+    for name, value in values.items():
+        if name == b'_version':
+            continue
+
+        version, payload = value.decode('utf-8').split(' ', 1)
+        if int(version) > since:
+            notifications.append({'name': name.decode('utf-8'), 'data': json.loads(payload),
+                                  'timestamp': int(version) / 1000000})
+
+    return sorted(notifications, key=lambda notification: notification['timestamp'])
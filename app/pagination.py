@@ -0,0 +1,90 @@
+import base64
+import binascii
+import json
+import operator
+from datetime import datetime
+
+from app import db
+
+
+class KeysetPage:
+    """Page of rows ordered by key columns descending with opaque cursors of the neighbouring pages"""
+
+    def __init__(self, items: list, columns: list, has_older: bool, has_newer: bool):
+        self.items = items
+        self.next_cursor = encode_cursor(_row_key(items[-1], columns)) if items and has_older else None
+        self.prev_cursor = encode_cursor(_row_key(items[0], columns)) if items and has_newer else None
+
+    @classmethod
+    def from_rows(cls, rows: list, columns: list, objects_per_page: int, newer: bool, from_cursor: bool):
+        """
+        Builds the page from {rows} fetched in traversal order with one extra row to detect the next page:
+        newest first for the first and older pages, oldest first for the newer ones
+        """
+
+        if newer:
+            return cls(rows[:objects_per_page][::-1], columns, True, len(rows) > objects_per_page)
+
+        return cls(rows[:objects_per_page], columns, len(rows) > objects_per_page, from_cursor)
+
+
+def _row_key(row, columns: list) -> list:
+    return [getattr(row, column.key) for column in columns]
+
+
+def encode_cursor(values: list) -> str:
+    """Encodes key column values of a row into the url-safe cursor"""
+
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def decode_cursor(cursor: str, columns: list):
+    """Returns key column values encoded in {cursor} or None if the cursor is malformed"""
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            return None
+
+        return [datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) else int(value)
+                for column, value in zip(columns, payload)]
+
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def compare_keys(columns: list, values: list, newer: bool):
+    """Builds (column1, column2, ...) > (value1, value2, ...) condition for {newer} rows, < otherwise"""
+
+    compare = operator.gt if newer else operator.lt
+    condition = compare(columns[-1], values[-1])
+    for column, value in zip(reversed(columns[:-1]), reversed(values[:-1])):
+        condition = db.or_(compare(column, value), db.and_(column == value, condition))
+
+    return condition
+
+
+def paginate_keyset(query, columns: list, objects_per_page: int, before=None, after=None) -> KeysetPage:
+    """
+    Returns page of {query} ordered by {columns} descending. {before} cursor gives the page of older rows,
+    {after} cursor the page of newer ones, malformed cursors give the first page. No total count is queried
+    """
+
+    query = query.order_by(None)
+    newer = not before and bool(after)
+    values = decode_cursor(before or after, columns) if before or after else None
+
+    if values is None:
+        rows = query.order_by(*[column.desc() for column in columns]).limit(objects_per_page + 1).all()
+        return KeysetPage.from_rows(rows, columns, objects_per_page, False, False)
+
+    order = [column.asc() if newer else column.desc() for column in columns]
+    rows = query.filter(compare_keys(columns, values, newer)).order_by(*order).limit(objects_per_page + 1).all()
+
+    if newer and len(rows) <= objects_per_page:
+        # Reached the newest rows: show a full first page instead of a short one
+        return paginate_keyset(query, columns, objects_per_page)
+
+    return KeysetPage.from_rows(rows, columns, objects_per_page, newer, True)
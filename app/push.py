@@ -0,0 +1,100 @@
+import json
+import threading
+from time import monotonic
+
+import redis
+from flask import current_app
+
+from app import notification_store
+
+_streams = None
+_streams_lock = threading.Lock()
+
+
+def _channel(user_id: int) -> str:
+    return f'notifications:{user_id}'
+
+
+def publish_after_commit(session, user_id: int, message: dict) -> None:
+    """
+    Schedules {message} to be pushed to the open streams of {user_id} once the {session} transaction is committed.
+    Messages without timestamp are saved to the notification store first
+    """
+
+    session.info.setdefault('pending_notifications', []).append((user_id, message))
+
+
+def after_commit(session) -> None:
+    """Stores and publishes the notifications added during the committed transaction"""
+
+    messages = session.info.pop('pending_notifications', [])
+    if not messages:
+        return None
+
+    try:
+        pipeline = current_app.redis.pipeline(transaction=False)
+        for user_id, message in messages:
+            if message.get('timestamp') is None:
+                message['timestamp'] = notification_store.store(user_id, message['name'], message['data'])
+            pipeline.publish(_channel(user_id), json.dumps(message))
+        pipeline.execute()
+    except redis.exceptions.RedisError:
+        current_app.logger.warning('Could not publish notifications: Redis is not available')
+
+
+def after_rollback(session) -> None:
+    """Drops the notifications added during the rolled back transaction"""
+
+    session.info.pop('pending_notifications', None)
+
+
+def acquire_stream() -> bool:
+    """Takes one of NOTIFICATION_STREAMS_PER_WORKER stream slots of the process. Returns False if none is free"""
+
+    global _streams
+    with _streams_lock:
+        if _streams is None:
+            _streams = threading.BoundedSemaphore(current_app.config['NOTIFICATION_STREAMS_PER_WORKER'])
+
+    return _streams.acquire(blocking=False)
+
+
+def release_stream() -> None:
+    _streams.release()
+
+
+def _event(message: dict) -> str:
+    return f'id: {message["timestamp"]}\ndata: {json.dumps(message)}\n\n'
+
+
+def subscribe(user_id: int):
+    """Returns Redis subscription to the notifications of {user_id}"""
+
+    pubsub = current_app.redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_channel(user_id))
+
+    return pubsub
+
+
+def stream(pubsub, backlog: list[dict], heartbeat: float, timeout: float):
+    """
+    Yields Server-Sent Events with the {backlog} notifications and then the ones published to {pubsub}.
+    Comment lines are sent every {heartbeat} seconds to detect closed connections, the stream is closed after
+    {timeout} seconds and reopened by the browser, so the worker is released from time to time
+    """
+
+    try:
+        yield 'retry: 1000\n\n'
+        for message in backlog:
+            yield _event(message)
+
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            message = pubsub.get_message(timeout=heartbeat)
+            if message is None:
+                yield ': heartbeat\n\n'
+            elif message['type'] == 'message':
+                yield _event(json.loads(message['data']))
+
+    except redis.exceptions.RedisError:
+        return None
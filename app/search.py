@@ -1,26 +1,275 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from time import time
+
+import redis
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
 from flask import current_app
 
+from app.local_search import LocalSearchBackend
 
-def add_to_index(index: str, model) -> None:
-    """Adds model entry to index"""
+# Hash of search results cache lookups and misses per index
+CACHE_STATS_KEY = 'search:cache:stats'
+
+
+class ElasticsearchBackend:
+    """
+    Search backend sending index changes and queries to Elasticsearch. Changes return once they are searchable,
+    so the cached results invalidated after them are not cached again from the index missing them
+    """
+
+    def __init__(self, url: str):
+        self.client = Elasticsearch([url])
+
+    def index(self, index: str, id: int, payload: dict) -> None:
+        self.client.index(index=index, id=id, body=payload, refresh='wait_for')
+
+    def delete(self, index: str, id: int) -> None:
+        self.client.delete(index=index, id=id, refresh='wait_for')
+
+    def bulk(self, index: str, actions: list) -> set:
+        """Sends (operation, id, payload) {actions} with the bulk API. Returns ids of the failed actions"""
+
+        documents = []
+        for operation, id, payload in actions:
+            document = {'_op_type': operation, '_index': index, '_id': id}
+            if payload is not None:
+                document['_source'] = payload
+            documents.append(document)
+
+        _, errors = bulk(self.client, documents, raise_on_error=False, refresh='wait_for')
+
+        failed_ids = set()
+        for error in errors:
+            (operation, result), = error.items()
+            if operation != 'delete' or result.get('status') != 404:
+                failed_ids.add(int(result['_id']))
+
+        return failed_ids
+
+    def query(self, index: str, string_to_search: str, page_number: int, objects_per_page: int,
+              fields=None) -> (list, int):
+        """Returns (id, stored fields) pairs of the entries matching {string_to_search} in {fields} and their number"""
+
+        search = self.client.search(
+            index=index,
+            body={
+                'query': {'multi_match': {'query': string_to_search, 'fields': fields or ['*']}},
+                '_source': ['stored'],
+                'from': (page_number - 1) * objects_per_page, 'size': objects_per_page
+            })
+
+        hits = [(int(hit['_id']), hit.get('_source', {}).get('stored')) for hit in search['hits']['hits']]
+
+        return hits, search['hits']['total']['value']
+
+    def create_index(self, index: str) -> None:
+        # Fields stored for rendering search results are kept in the documents but not indexed
+        self.client.indices.create(index=index, body={
+            'mappings': {'properties': {'stored': {'type': 'object', 'enabled': False}}}
+        })
+
+    def swap_alias(self, alias: str, new_index: str) -> None:
+        """Atomically points {alias} to {new_index} and drops the indices it pointed to"""
+
+        self.client.indices.refresh(index=new_index)
+        old_indices = []
+        actions = [{'add': {'index': new_index, 'alias': alias}}]
+        if self.client.indices.exists_alias(name=alias):
+            old_indices = list(self.client.indices.get_alias(name=alias))
+            actions = [{'remove': {'index': old_index, 'alias': alias}} for old_index in old_indices] + actions
+        elif self.client.indices.exists(index=alias):
+            # Index created before aliases were used has to be removed within the same request
+            actions.insert(0, {'remove_index': {'index': alias}})
+
+        self.client.indices.update_aliases(body={'actions': actions})
+        for old_index in old_indices:
+            self.client.indices.delete(index=old_index)
 
-    if not current_app.elasticsearch:
-        return None
+
+def create_backend(config: dict):
+    """
+    Returns search backend for the app config: Elasticsearch if ELASTICSEARCH_URL is set, otherwise the built-in
+    engine stored at SEARCH_INDEX_PATH. Returns None if neither is configured
+    """
+
+    if config['ELASTICSEARCH_URL']:
+        return ElasticsearchBackend(config['ELASTICSEARCH_URL'])
+
+    if config['SEARCH_INDEX_PATH']:
+        return LocalSearchBackend(config['SEARCH_INDEX_PATH'])
+
+    return None
+
+
+def get_payload(model) -> dict:
+    """
+    Returns index document for the model entry. Models hydrating search results from the index also store the
+    fields needed for rendering under 'stored' key
+    """
 
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
 
-    current_app.elasticsearch.index(index=index, id=model.id, body=payload)
+    if model.__hydrate__:
+        payload['stored'] = model.get_stored_fields()
+
+    return payload
+
+
+def add_to_index(index: str, model) -> None:
+    """Adds model entry to index"""
+
+    if not current_app.search_backend:
+        return None
+
+    current_app.search_backend.index(index, model.id, get_payload(model))
+    _bump_generation(index)
 
 
 def remove_from_index(index: str, model) -> None:
     """Removes model entry from index"""
 
-    if not current_app.elasticsearch:
+    if not current_app.search_backend:
         return None
 
-    current_app.elasticsearch.delete(index=index, id=model.id)
+    current_app.search_backend.delete(index, model.id)
+    _bump_generation(index)
+
+
+def bulk_index(index: str, actions: list) -> set:
+    """
+    Sends (operation, id, payload) {actions} to the index with the bulk API: operation is 'index' or 'delete'.
+    The actions are also sent to the fresh index being rebuilt for {index} so it misses no changes.
+    Returns ids of the failed actions, deletes of entries missing in the index are not counted as failed
+    """
+
+    if not current_app.search_backend or not actions:
+        return set()
+
+    failed_ids = current_app.search_backend.bulk(index, actions)
+    _bump_generation(index)
+
+    try:
+        target = current_app.redis.hget(_reindex_key(index), 'target')
+    except redis.exceptions.RedisError:
+        target = None
+    if target and target.decode('utf-8') != index:
+        failed_ids.update(current_app.search_backend.bulk(target.decode('utf-8'), actions))
+
+    return failed_ids
+
+
+def _reindex_key(index: str) -> str:
+    return f'search:reindex:{index}'
+
+
+def _generation_key(index: str) -> str:
+    return f'search:generation:{index}'
+
+
+def _bump_generation(index: str) -> None:
+    """Invalidates cached search results of the index: called once the changes are searchable"""
+
+    try:
+        current_app.redis.incr(_generation_key(index))
+    except redis.exceptions.RedisError:
+        current_app.logger.warning(f'Could not invalidate search cache of {index}: Redis is not available')
+
+
+def reindex(index: str, read_chunks, workers: int, new_index=False, resume=False, on_progress=None) -> int:
+    """
+    Sends chunks of (last id, actions) pairs produced by {read_chunks}(after id) to the index from a pool of
+    {workers} threads. Progress is checkpointed in Redis after every chunk, so an interrupted run is continued
+    with {resume}. With {new_index} the entries are sent to a fresh index which replaces the previous one under
+    the {index} alias once all of them are sent. Returns number of entries sent
+    """
+
+    backend = current_app.search_backend
+    key = _reindex_key(index)
+
+    state = {name.decode('utf-8'): value.decode('utf-8')
+             for name, value in current_app.redis.hgetall(key).items()} if resume else {}
+    if not state:
+        state = {'target': f'{index}-{int(time())}' if new_index else index, 'last_id': 0}
+        if new_index:
+            backend.create_index(state['target'])
+        current_app.redis.hset(key, mapping=state)
+
+    target = state['target']
+    sent = 0
+
+    def checkpoint(last_id: int, count: int, future) -> None:
+        nonlocal sent
+        failed_ids = future.result()
+        if failed_ids:
+            raise RuntimeError(f'{len(failed_ids)} entries failed to be indexed, run again with resume to retry')
+        sent += count
+        current_app.redis.hset(key, 'last_id', last_id)
+        if on_progress:
+            on_progress(sent, last_id)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for last_id, actions in read_chunks(int(state['last_id'])):
+            in_flight.append((last_id, len(actions), executor.submit(backend.bulk, target, actions)))
+
+            # Chunks are checkpointed in order, so the saved id never skips a chunk still being sent
+            while in_flight and (len(in_flight) > 2 * workers or in_flight[0][2].done()):
+                checkpoint(*in_flight.popleft())
+
+        while in_flight:
+            checkpoint(*in_flight.popleft())
+
+    if target != index:
+        backend.swap_alias(index, target)
+    current_app.redis.delete(key)
+    _bump_generation(index)
+
+    return sent
+
+
+def index_chunks(index: str, chunks, workers: int, on_progress=None) -> int:
+    """
+    Sends {chunks} of (last id, actions) pairs to the index with bulk_index from a pool of {workers} threads, so
+    a fresh index being rebuilt gets them too. The reindex state is only read: nothing is checkpointed.
+    Returns number of entries sent, raises RuntimeError if some of them failed
+    """
+
+    app = current_app._get_current_object()
+    sent = 0
+    failed = 0
+
+    def send(actions: list) -> set:
+        with app.app_context():
+            return bulk_index(index, actions)
+
+    def collect(last_id: int, count: int, future) -> None:
+        nonlocal sent, failed
+        failed_ids = future.result()
+        sent += count - len(failed_ids)
+        failed += len(failed_ids)
+        if on_progress:
+            on_progress(sent, last_id)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for last_id, actions in chunks:
+            in_flight.append((last_id, len(actions), executor.submit(send, actions)))
+            while in_flight and (len(in_flight) > 2 * workers or in_flight[0][2].done()):
+                collect(*in_flight.popleft())
+
+        while in_flight:
+            collect(*in_flight.popleft())
+
+    if failed:
+        raise RuntimeError(f'{failed} entries failed to be indexed')
+
+    return sent
 
 
 def query_index(index: str, string_to_search: str, page_number: int, objects_per_page: int) -> (list, int):
@@ -29,16 +278,64 @@ def query_index(index: str, string_to_search: str, page_number: int, objects_per
     returns list of search results ids and total number of results
     """
 
-    if not current_app.elasticsearch:
+    hits, total = query_index_documents(index, string_to_search, page_number, objects_per_page)
+
+    return [id for id, stored in hits], total
+
+
+def query_index_documents(index: str, string_to_search: str, page_number: int, objects_per_page: int,
+                          fields=None) -> (list, int):
+    """
+    Searches for {query} in {fields} (all the fields by default) and paginates the result:
+    returns list of (id, stored fields) pairs of search results and total number of results.
+    Results are cached in Redis until the index changes or SEARCH_CACHE_TTL expires
+    """
+
+    if not current_app.search_backend:
         return [], 0
 
-    search = current_app.elasticsearch.search(
-        index=index,
-        body={
-            'query': {'multi_match': {'query': string_to_search, 'fields': ['*']}},
-            'from': (page_number - 1) * objects_per_page, 'size': objects_per_page
-        })
+    string_to_search = ' '.join(string_to_search.lower().split())
+    # Searches of the same string in different fields have different results
+    digest = md5(json.dumps([string_to_search, sorted(fields) if fields else None]).encode('utf-8')).hexdigest()
+    key = f'search:cache:{index}:{digest}:{page_number}:{objects_per_page}'
+
+    try:
+        pipeline = current_app.redis.pipeline(transaction=False)
+        pipeline.mget(_generation_key(index), key)
+        pipeline.hincrby(CACHE_STATS_KEY, f'{index}:lookups')
+        (generation, cached), _ = pipeline.execute()
+    except redis.exceptions.RedisError:
+        return current_app.search_backend.query(index, string_to_search, page_number, objects_per_page, fields)
+
+    generation = int(generation or 0)
+    if cached:
+        cached = json.loads(cached)
+        if cached['generation'] == generation:
+            return [tuple(hit) for hit in cached['hits']], cached['total']
+
+    hits, total = current_app.search_backend.query(index, string_to_search, page_number, objects_per_page, fields)
+
+    try:
+        pipeline = current_app.redis.pipeline(transaction=False)
+        pipeline.set(key, json.dumps({'generation': generation, 'hits': hits, 'total': total}),
+                     ex=current_app.config['SEARCH_CACHE_TTL'])
+        pipeline.hincrby(CACHE_STATS_KEY, f'{index}:misses')
+        pipeline.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+    return hits, total
+
+
+def get_cache_stats() -> dict:
+    """Returns {index: (lookups, hits)} statistics of the search results cache"""
+
+    counters = {name.decode('utf-8'): int(value) for name, value in current_app.redis.hgetall(CACHE_STATS_KEY).items()}
 
-    search_result_ids = [int(hit['_id']) for hit in search['hits']['hits']]
+    stats = {}
+    for name, value in counters.items():
+        index, counter = name.rsplit(':', 1)
+        if counter == 'lookups':
+            stats[index] = (value, value - counters.get(f'{index}:misses', 0))
 
-    return search_result_ids, search['hits']['total']['value']
+    return stats
@@ -5,28 +5,53 @@ function set_message_count(n) {
     $('#message_count').css('visibility', n ? 'visible' : 'hidden');
 }
 
-/* Function updating unread messages count */
+/* Function handling a notification */
+
+function handle_notification(notification) {
+    switch (notification.name) {
+        case 'unread_message_count':
+            set_message_count(notification.data);
+            break;
+        case 'task_progress':
+            set_task_progress(notification.data.task_id, notification.data.progress);
+            break;
+    }
+}
+
+/* Function updating unread messages count: notifications are pushed by the server, polling is the fallback */
 
 $(function () {
     var since = 0;
     var url = "/notifications"
-    setInterval(function () {
-        $.ajax(url + '?since=' + since).done(
-            function (notifications) {
-                for (var i = 0; i < notifications.length; i++) {
-                    switch (notifications[i].name) {
-                        case 'unread_message_count':
-                            set_message_count(notifications[i].data);
-                            break;
-                        case 'task_progress':
-                            set_task_progress(
-                                notifications[i].data.task_id,
-                                notifications[i].data.progress);
-                            break;
+
+    function poll() {
+        setInterval(function () {
+            $.ajax(url + '?since=' + since).done(
+                function (notifications) {
+                    for (var i = 0; i < notifications.length; i++) {
+                        handle_notification(notifications[i]);
+                        since = notifications[i].timestamp;
                     }
-                    since = notifications[i].timestamp;
                 }
-            }
-        );
-    }, 10000);
+            );
+        }, 10000);
+    }
+
+    if (!window.EventSource) {
+        poll();
+        return;
+    }
+
+    var source = new EventSource(url + '/stream');
+    source.onmessage = function (event) {
+        var notification = JSON.parse(event.data);
+        handle_notification(notification);
+        since = notification.timestamp;
+    };
+    source.onerror = function () {
+        // The browser reconnects by itself unless the server refused the stream
+        if (source.readyState === EventSource.CLOSED) {
+            poll();
+        }
+    };
 });
@@ -1,22 +1,45 @@
 /* Handles 'Translate' button click */
 
-function translate(postTextElem, postText, sourceLang, destLang) {
+function translate(postTextElem, postText, sourceLang, destLang, postId) {
     let current_text = $(postTextElem).text();
+    if (current_text !== postText) {
+        $(postTextElem).text(postText);
+        return;
+    }
     $.post('/translate', {
+        post_id: postId,
         text_to_translate: $(postTextElem).text(),
         source_language: sourceLang,
         destination_language: destLang
     }).done(function (response) {
-        if (current_text === postText) {
-            $(postTextElem).text(response['text']);
-        } else {
-            $(postTextElem).text(postText);
-        }
+        $(postTextElem).text(response['text']);
     }).fail(function () {
-        if (current_text === postText) {
-            $(postTextElem).text("{{ _('Error: Could not contact server.') }}");
-        } else {
-            $(postTextElem).text(postText);
+        $(postTextElem).text("{{ _('Error: Could not contact server.') }}");
+    });
+}
+
+/* Handles 'Translate all' button click: translates every foreign post on the page with one request */
+
+function translateAll(destLang) {
+    let posts = {};
+    $('.post_body').each(function () {
+        let language = $(this).data('language');
+        if (language && language !== destLang) {
+            posts[$(this).data('post-id')] = this;
         }
     });
+    if ($.isEmptyObject(posts)) {
+        return;
+    }
+
+    $.ajax({
+        url: '/translate/batch',
+        type: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({posts: Object.keys(posts).map(Number), destination_language: destLang})
+    }).done(function (response) {
+        $.each(response['translations'], function (postId, text) {
+            $(posts[postId]).text(text);
+        });
+    });
 }
@@ -1,40 +1,52 @@
-import json
 import sys
+from time import monotonic
+
 from flask import render_template
 from flask_babel import _
 from rq import get_current_job
 
 from app import create_app
-from app import db
+from app import db, export, language, last_seen, timeline
 from app.email import send_email
-from app.models import Task, User, Post
+from app.mixins import SearchableMixin
+from app.models import Task, User, Post, PostTranslation, SearchOutbox, followers
+from app.search import get_payload, bulk_index
+from app.translate import TranslationError
 
 app = create_app()
 app.app_context().push()
+language.preload()
+
 
+def export_posts(user_id: int, export_format='json', compress=False, filename=None, url=None) -> None:
+    """
+    Exports all the user's posts in {export_format} (json, ndjson or csv), gzipped if {compress} is set, into
+    {filename} in the exports directory and sends the {url} link to download it to the appropriate email.
+    Posts are streamed into the file, neither they nor the file are loaded in memory
+    """
 
-def export_posts(user_id: int) -> None:
-    """Exports all the user's posts and sends to the appropriate email"""
+    progress = ProgressReporter()
 
     try:
         user = User.query.get(user_id)
-        _set_task_progress(0)
-        posts_to_export = []
-        progress_counter = 0
-        total_posts = user.posts.count()
+        progress.total = user.post_count
 
-        for post in user.posts.order_by(Post.timestamp.asc()):
-            posts_to_export.append({'body': post.body, 'timestamp': post.timestamp.isoformat() + 'Z'})
-            progress_counter += 1
-            _set_task_progress(100 * progress_counter // total_posts)
+        def read_posts():
+            for post in export.read_posts(user_id):
+                yield post
+                progress.advance()
+
+        export.remove_expired(app.config['EXPORT_PATH'], app.config['EXPORT_TTL'])
+        export.save_posts(read_posts(), app.config['EXPORT_PATH'], filename, export_format, compress)
 
         send_email(
             _('[Blog] Your blog posts'),
             sender=app.config['MAIL_USERNAME'],
             recipients=[user.email],
-            text_body=render_template('email/export_posts.txt', user=user),
-            html_body=render_template('email/export_posts.html', user=user),
-            attachments=[('posts.json', 'application/json', json.dumps({'posts': posts_to_export}, indent=4))],
+            text_body=render_template('email/export_posts.txt', user=user, url=url,
+                                      days=app.config['EXPORT_TTL'] // (24 * 3600)),
+            html_body=render_template('email/export_posts.html', user=user, url=url,
+                                      days=app.config['EXPORT_TTL'] // (24 * 3600)),
             sync=True
         )
 
@@ -42,20 +54,189 @@ def export_posts(user_id: int) -> None:
         app.logger.error('Unhandled exception', exc_info=sys.exc_info())
 
     finally:
-        _set_task_progress(100)
+        progress.finish()
+
+
+class ProgressReporter:
+    """
+    Reports progress of the current job to its task: saves it in the job meta and notifies the user.
+    Progress is reported only when the percentage changes and not more often than once per {min_interval} seconds,
+    the job meta, the notification and the task are saved together
+    """
+
+    def __init__(self, total=0, min_interval=None):
+        self.total = total
+        self.done = 0
+        self.min_interval = app.config['TASK_PROGRESS_INTERVAL'] if min_interval is None else min_interval
+        self.job = get_current_job()
+        self.task = Task.query.get(self.job.get_id()) if self.job else None
+        self._reported = None
+        self._reported_at = None
+        self._report(0)
+
+    def advance(self, count=1) -> None:
+        """Marks {count} more items of {total} done"""
 
+        self.done += count
+        self.update(100 * self.done // self.total if self.total else 0)
 
-def _set_task_progress(progress: float) -> None:
-    """Sets the progress percentage for th task"""
+    def update(self, progress: int) -> None:
+        """Sets the progress percentage: it is reported if changed and the interval has passed"""
 
-    job = get_current_job()
+        progress = min(progress, 100)
+        if progress == self._reported or monotonic() - self._reported_at < self.min_interval:
+            return None
 
-    if job:
-        job.meta['progress'] = progress
-        job.save_meta()
-        task = Task.query.get(job.get_id())
-        task.user.add_notification('task_progress', {'task_id': job.get_id(), 'progress': progress})
+        self._report(progress)
+
+    def finish(self) -> None:
+        """Reports the task complete"""
+
+        if self._reported != 100:
+            self._report(100)
+
+    def _report(self, progress: int) -> None:
+        self._reported = progress
+        self._reported_at = monotonic()
+        if not self.task:
+            return None
+
+        self.job.meta['progress'] = progress
+        self.job.save_meta()
+        self.task.user.add_notification('task_progress', {'task_id': self.task.id, 'progress': progress})
 
         if progress >= 100:
-            task.complete = True
+            self.task.set_complete()
         db.session.commit()
+
+
+def fan_out_post(post_id: int) -> None:
+    """Adds the new post to the timelines of its author and the author's followers"""
+
+    post = Post.query.get(post_id)
+    if not post:
+        return None
+
+    entry = [(post.id, post.timestamp)]
+    timeline.add_posts([post.user_id], entry)
+
+    if post.author.follower_count > app.config['TIMELINE_FANOUT_MAX_FOLLOWERS']:
+        timeline.add_celebrity(post.user_id)
+        return None
+
+    follower_ids = db.session.query(followers.c.follower_id).filter(followers.c.followed_id == post.user_id)
+    timeline.add_posts([follower_id for follower_id, in follower_ids], entry)
+
+
+def rebuild_timeline(user_id: int) -> None:
+    """Materializes the user's timeline from the database"""
+
+    user = User.query.get(user_id)
+    if user:
+        posts = user.get_posts_from_followed_users().with_entities(Post.id, Post.timestamp)
+        timeline.replace(user_id, posts.limit(app.config['TIMELINE_LENGTH']).all())
+
+
+def invalidate_timelines(author_ids: tuple[int]) -> None:
+    """Drops timelines of the authors of the imported posts and of their followers"""
+
+    user_ids = set(author_ids)
+    author_ids = list(author_ids)
+    for i in range(0, len(author_ids), 1000):
+        user_ids.update(follower_id for follower_id, in db.session.query(followers.c.follower_id).filter(
+            followers.c.followed_id.in_(author_ids[i:i + 1000])))
+
+    timeline.invalidate(sorted(user_ids))
+
+
+def add_followed_to_timeline(user_id: int, followed_id: int) -> None:
+    """Merges the latest posts of the newly followed user into the user's timeline"""
+
+    posts = Post.query.filter_by(user_id=followed_id).order_by(Post.timestamp.desc()).with_entities(
+        Post.id, Post.timestamp)
+    timeline.add_posts([user_id], posts.limit(app.config['TIMELINE_LENGTH']).all())
+
+
+def remove_followed_from_timeline(user_id: int, followed_id: int) -> None:
+    """Removes posts of the unfollowed user from the user's timeline"""
+
+    posts = Post.query.filter_by(user_id=followed_id).order_by(Post.timestamp.desc()).with_entities(Post.id)
+    timeline.remove_posts(user_id, [post_id for post_id, in posts.limit(app.config['TIMELINE_LENGTH'])])
+
+
+def index_search_outbox() -> None:
+    """
+    Sends the committed index changes from the outbox to Elasticsearch with the bulk API.
+    Only the latest change of each object is sent, failed changes are kept in the outbox for the retry
+    """
+
+    models = {model.__tablename__: model for model in SearchableMixin.__subclasses__()}
+    failed_count = 0
+    last_id = 0
+
+    while True:
+        changes = SearchOutbox.query.filter(SearchOutbox.id > last_id).order_by(SearchOutbox.id).limit(
+            app.config['SEARCH_OUTBOX_BATCH']).all()
+        if not changes:
+            break
+        last_id = changes[-1].id
+
+        latest = {}
+        for change in changes:
+            latest.setdefault(change.index, {})[change.object_id] = change.operation
+
+        failed = set()
+        for index, operations in latest.items():
+            model = models[index]
+            ids = [object_id for object_id, operation in operations.items() if operation == 'index']
+            objects = {obj.id: obj for obj in model.eager_load(model.query.filter(model.id.in_(ids)))} if ids else {}
+
+            actions = []
+            for object_id in operations:
+                if object_id in objects:
+                    actions.append(('index', object_id, get_payload(objects[object_id])))
+                else:
+                    actions.append(('delete', object_id, None))
+
+            failed.update((index, object_id) for object_id in bulk_index(index, actions))
+
+        sent_ids = [change.id for change in changes if (change.index, change.object_id) not in failed]
+        SearchOutbox.query.filter(SearchOutbox.id.in_(sent_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        failed_count += len(failed)
+
+    lag = SearchOutbox.get_lag()
+    app.logger.info(f'Search outbox: {lag["pending"]} changes pending, lag {lag["lag"]:.1f}s')
+
+    if failed_count:
+        raise RuntimeError(f'{failed_count} search index changes failed')
+
+
+def prefetch_translations(post_id: int) -> None:
+    """Translates the popular post into all the supported languages and stores the translations"""
+
+    post = Post.query.get(post_id)
+    if not post:
+        return None
+
+    for locale in app.config['LANGUAGES']:
+        try:
+            PostTranslation.translate_posts([post], locale)
+            db.session.commit()
+        except TranslationError as error:
+            app.logger.warning(f'Could not prefetch translation of post {post_id} into {locale}: {error}')
+
+
+def detect_post_language(post_id: int) -> None:
+    """Detects language of the new post"""
+
+    post = Post.query.get(post_id)
+    if post:
+        post.language = language.detect_language(post.body)
+        db.session.commit()
+
+
+def flush_last_seen() -> None:
+    """Writes the buffered last seen times of the users to the database"""
+
+    last_seen.flush()
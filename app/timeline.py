@@ -0,0 +1,176 @@
+from datetime import datetime, timezone
+
+import redis
+from flask import current_app
+
+# Set of users whose posts are not fanned out because of too many followers
+CELEBRITIES_KEY = 'timeline:celebrities'
+
+# Member with the lowest score marking a timeline that has never been trimmed to TIMELINE_LENGTH
+COMPLETE_MARKER = '0'
+
+# Adds score/post id pairs from ARGV to every existing timeline in KEYS and trims them to ARGV[1] posts
+_ADD_TO_EXISTING = """
+local length = tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for i = 2, #ARGV, 2 do
+            redis.call('ZADD', key, ARGV[i], ARGV[i + 1])
+        end
+        redis.call('ZREMRANGEBYRANK', key, 0, -length - 1)
+    end
+end
+return 0
+"""
+
+# Returns member/score pairs of KEYS[1] timeline past the ARGV[2] score towards the newer posts if ARGV[1] is 1, older
+# otherwise: all the ones sharing the score, ARGV[3] ones past it and all the ones sharing the score of the last of
+# them, since members sharing a score are ordered as strings, not as post ids. Returns nil if the timeline does not
+# exist, its expiration is reset to ARGV[4] seconds otherwise
+_PAGE = """
+local key, newer, count = KEYS[1], ARGV[1] == '1', tonumber(ARGV[3])
+if redis.call('EXPIRE', key, ARGV[4]) == 0 then
+    return false
+end
+
+local members = {}
+local function add(range)
+    for _, value in ipairs(range) do
+        members[#members + 1] = value
+    end
+end
+
+local start = ARGV[2]
+if start == '' then
+    start = newer and '-inf' or '+inf'
+else
+    add(redis.call('ZRANGEBYSCORE', key, start, start, 'WITHSCORES'))
+    start = '(' .. start
+end
+
+local page
+if newer then
+    page = redis.call('ZRANGEBYSCORE', key, start, '+inf', 'WITHSCORES', 'LIMIT', 0, count)
+else
+    page = redis.call('ZREVRANGEBYSCORE', key, start, '-inf', 'WITHSCORES', 'LIMIT', 0, count)
+end
+add(page)
+if #page == 2 * count then
+    add(redis.call('ZRANGEBYSCORE', key, page[#page], page[#page], 'WITHSCORES'))
+end
+
+return members
+"""
+
+
+def _timeline_key(user_id: int) -> str:
+    return f'timeline:{user_id}'
+
+
+def _score(timestamp: datetime) -> float:
+    """Converts UTC post timestamp to the sorted set score"""
+
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def add_posts(user_ids: list[int], posts: list[tuple[int, datetime]]) -> None:
+    """
+    Adds (post id, timestamp) {posts} to the timelines of {user_ids}.
+    Timelines not materialized yet are skipped: they are built from the database on the next read
+    """
+
+    if not user_ids or not posts:
+        return None
+
+    script = current_app.redis.register_script(_ADD_TO_EXISTING)
+    args = [current_app.config['TIMELINE_LENGTH']]
+    for post_id, timestamp in posts:
+        args.extend([_score(timestamp), post_id])
+
+    for i in range(0, len(user_ids), 1000):
+        script(keys=[_timeline_key(user_id) for user_id in user_ids[i:i + 1000]], args=args)
+
+
+def remove_posts(user_id: int, post_ids: list[int]) -> None:
+    """Removes posts from the timeline of {user_id}"""
+
+    if post_ids:
+        current_app.redis.zrem(_timeline_key(user_id), *post_ids)
+
+
+def replace(user_id: int, posts: list[tuple[int, datetime]]) -> None:
+    """Materializes the timeline of {user_id} from the latest (post id, timestamp) {posts}"""
+
+    length = current_app.config['TIMELINE_LENGTH']
+    mapping = {post_id: _score(timestamp) for post_id, timestamp in posts[:length]}
+    if len(posts) < length:
+        mapping[COMPLETE_MARKER] = 0
+
+    key = _timeline_key(user_id)
+    pipeline = current_app.redis.pipeline()
+    pipeline.delete(key)
+    if mapping:
+        pipeline.zadd(key, mapping)
+    pipeline.expire(key, current_app.config['TIMELINE_TTL'])
+    pipeline.delete(f'{key}:rebuilding')
+    pipeline.execute()
+
+
+def invalidate(user_ids: list[int]) -> None:
+    """Drops the timelines of {user_ids}: they are rebuilt from the database on the next read"""
+
+    for i in range(0, len(user_ids), 1000):
+        current_app.redis.delete(*[_timeline_key(user_id) for user_id in user_ids[i:i + 1000]])
+
+
+def get_page(user_id: int, objects_per_page: int, cursor=None, newer=False):
+    """
+    Returns post ids of the timeline page in traversal order plus one id of the following page if there is one.
+    The page starts after the (timestamp, post id) {cursor}: towards newer posts if {newer} is set, older otherwise.
+    Returns None if the page can not be served from Redis: the timeline is cold (a rebuild is queued then),
+    expired or trimmed before the requested page
+    """
+
+    key = _timeline_key(user_id)
+
+    try:
+        script = current_app.redis.register_script(_PAGE)
+        members = script(keys=[key], args=[int(newer), '' if cursor is None else repr(_score(cursor[0])),
+                                           objects_per_page + 1, current_app.config['TIMELINE_TTL']])
+
+        if members is None:
+            if current_app.redis.set(f'{key}:rebuilding', 1, nx=True, ex=60):
+                current_app.task_queue.enqueue('app.tasks.rebuild_timeline', user_id)
+            return None
+
+    except redis.exceptions.RedisError:
+        return None
+
+    members = dict(zip(members[::2], members[1::2]))
+    complete = COMPLETE_MARKER.encode() in members
+    entries = sorted(((float(score), int(member)) for member, score in members.items()
+                      if member != COMPLETE_MARKER.encode()), reverse=not newer)
+    if cursor is not None:
+        position = (_score(cursor[0]), cursor[1])
+        entries = [entry for entry in entries if (entry > position if newer else entry < position)]
+
+    if not newer and len(entries) <= objects_per_page and not complete:
+        # The end of a trimmed timeline is reached, older posts are in the database only
+        return None
+
+    return [post_id for score, post_id in entries[:objects_per_page + 1]]
+
+
+def get_celebrities() -> set[int]:
+    """Returns ids of the users whose posts are not fanned out to the timelines"""
+
+    try:
+        return {int(user_id) for user_id in current_app.redis.smembers(CELEBRITIES_KEY)}
+    except redis.exceptions.RedisError:
+        return set()
+
+
+def add_celebrity(user_id: int) -> None:
+    """Stops fanning out posts of {user_id}: followers get their timelines from the database"""
+
+    current_app.redis.sadd(CELEBRITIES_KEY, user_id)
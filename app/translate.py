@@ -1,23 +1,150 @@
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+
+import redis
 import requests
 from flask_babel import _
 from flask import current_app as app
 
+TRANSLATOR_URL = 'https://api.cognitive.microsofttranslator.com/translate'
 
-def translate(text_to_translate: str, source_language: str, destination_language: str) -> str:
-    """Translates text from source language to destination language. Returns translated text"""
+# Texts sent to the translator in one request: the API accepts up to 1000 array elements
+BATCH_SIZE = 100
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TranslationError(Exception):
+    """Raised when the translation service is not configured or fails"""
+
+
+class _LRUCache:
+    """Thread-safe in-process cache of the most recently used translations"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_lru = None
+_lru_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """Returns HTTP session keeping connections to the translator alive between the requests"""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=app.config['TRANSLATOR_POOL_SIZE'])
+            _session.mount('https://', adapter)
+
+    return _session
+
+
+def _get_lru() -> _LRUCache:
+    """Returns the in-process cache of translations: the first requests of the threads share one cache"""
 
-    if 'MS_TRANSLATOR_KEY' not in app.config or not app.config['MS_TRANSLATOR_KEY']:
-        return _('Error: the translation service is not configured.')
+    global _lru
+    with _lru_lock:
+        if _lru is None:
+            _lru = _LRUCache(app.config['TRANSLATION_LRU_SIZE'])
+
+    return _lru
+
+
+def _cache_key(text: str, source_language: str, destination_language: str) -> str:
+    return f'translation:{sha256(text.encode("utf-8")).hexdigest()}:{source_language}:{destination_language}'
+
+
+def _request_translations(texts: list[str], source_language: str, destination_language: str) -> list[str]:
+    """Translates {texts} with one call to the translator"""
 
-    request_url = f'https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&' \
-                  f'from={source_language}&to={destination_language}'
     headers = {
         'Ocp-Apim-Subscription-Key': app.config['MS_TRANSLATOR_KEY'],
-        'Ocp-Apim-Subscription-Region': 'westus2',
+        'Ocp-Apim-Subscription-Region': app.config['MS_TRANSLATOR_REGION'],
     }
-    response = requests.post(request_url, headers=headers, json=[{'Text': text_to_translate}])
+    params = {'api-version': '3.0', 'from': source_language, 'to': destination_language}
+
+    try:
+        response = _get_session().post(TRANSLATOR_URL, params=params, headers=headers,
+                                       json=[{'Text': text} for text in texts],
+                                       timeout=app.config['TRANSLATOR_TIMEOUT'])
+        response.raise_for_status()
+        return [item['translations'][0]['text'] for item in response.json()]
+
+    except (requests.RequestException, ValueError, KeyError, IndexError) as error:
+        app.logger.warning(f'Translation of {len(texts)} texts failed: {error}')
+        raise TranslationError(_('Error: the translation service failed.'))
+
+
+def translate_texts(texts: list[str], source_language: str, destination_language: str) -> list[str]:
+    """
+    Translates {texts} from source language to destination language. Returns translated texts in the same order.
+    Translations are looked up in the in-process cache, then in Redis, the rest is sent to the translator in batches
+    """
+
+    if not app.config.get('MS_TRANSLATOR_KEY'):
+        raise TranslationError(_('Error: the translation service is not configured.'))
 
-    if not response.ok:
-        return _('Error: the translation service failed.')
+    lru = _get_lru()
+    keys = [_cache_key(text, source_language, destination_language) for text in texts]
+    translations = {key: lru.get(key) for key in keys}
+
+    missing = [key for key in dict.fromkeys(keys) if translations[key] is None]
+    if missing:
+        try:
+            for key, value in zip(missing, app.redis.mget(missing)):
+                if value is not None:
+                    translations[key] = value.decode('utf-8')
+                    lru.set(key, translations[key])
+        except redis.exceptions.RedisError:
+            pass
+
+    untranslated = {key: text for key, text in zip(keys, texts) if translations[key] is None}
+    items = list(untranslated.items())
+    for i in range(0, len(items), BATCH_SIZE):
+        batch = items[i:i + BATCH_SIZE]
+        results = _request_translations([text for key, text in batch], source_language, destination_language)
+
+        new_translations = {key: result for (key, text), result in zip(batch, results)}
+        for key, result in new_translations.items():
+            translations[key] = result
+            lru.set(key, result)
+
+        try:
+            pipeline = app.redis.pipeline(transaction=False)
+            for key, result in new_translations.items():
+                pipeline.set(key, result, ex=app.config['TRANSLATION_CACHE_TTL'])
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    return [translations[key] for key in keys]
+
+
+def translate(text_to_translate: str, source_language: str, destination_language: str) -> str:
+    """Translates text from source language to destination language. Returns translated text"""
 
-    return response.json()[0]['translations'][0]['text']
+    try:
+        return translate_texts([text_to_translate], source_language, destination_language)[0]
+    except TranslationError as error:
+        return str(error)
@@ -0,0 +1,118 @@
+"""
+Measures peak Python memory and time of the whole export job in every format: the posts are read, written into the
+exports directory and the email with the download link is sent to a local SMTP server. Peak memory stays flat as
+the number of posts grows, since neither the posts nor the file are loaded in memory.
+
+    python benchmarks/export_benchmark.py --posts 10000 100000 500000
+"""
+import argparse
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+    """Minimal SMTP server accepting every message: counts the bytes of the received messages"""
+
+    received = 0
+
+    def handle(self) -> None:
+        self.wfile.write(b'220 benchmark\r\n')
+        data = False
+        for line in self.rfile:
+            if data:
+                if line == b'.\r\n':
+                    data = False
+                    self.wfile.write(b'250 OK\r\n')
+                else:
+                    SMTPSink.received += len(line)
+                continue
+
+            command = line[:4].upper()
+            if command == b'DATA':
+                data = True
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return None
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+def measure(function, *args) -> tuple[float, float]:
+    """Returns peak traced memory in MB and time in seconds of {function}"""
+
+    tracemalloc.start()
+    started = perf_counter()
+    function(*args)
+    elapsed = perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return peak / 1024 / 1024, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, nargs='+', default=[10000, 50000, 200000], help='numbers of posts')
+    args = parser.parse_args()
+
+    random.seed(42)
+    words = [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=random.randint(3, 9))) for _ in range(5000)]
+
+    with tempfile.TemporaryDirectory() as directory, \
+            socketserver.ThreadingTCPServer(('localhost', 0), SMTPSink) as smtp:
+        threading.Thread(target=smtp.serve_forever, daemon=True).start()
+
+        # The job module creates its application from the environment on import
+        os.environ.update({
+            'DATABASE_URL': 'sqlite:///' + os.path.join(directory, 'benchmark.db'),
+            'EXPORT_PATH': os.path.join(directory, 'exports'),
+            'SEARCH_INDEX_PATH': os.path.join(directory, 'search.db'),
+            'MAIL_SERVER': 'localhost',
+            'MAIL_PORT': str(smtp.server_address[1]),
+            'MAIL_USERNAME': 'benchmark@example.com',
+            'LOG_TO_STDOUT': '1',
+        })
+        os.environ.pop('ELASTICSEARCH_URL', None)
+        from app import db, export, tasks
+        from app.models import Post, User
+
+        db.create_all()
+        user = User(username='benchmark', email='benchmark@example.com')
+        db.session.add(user)
+        db.session.commit()
+
+        print(f'{"posts":>8} {"export":<12} {"peak MB":>9} {"seconds":>9} {"size MB":>9} {"email KB":>9}')
+        inserted = 0
+        started = datetime(2020, 1, 1)
+        for count in sorted(args.posts):
+            db.session.execute(Post.__table__.insert(), [
+                {'user_id': user.id, 'body': ' '.join(random.choices(words, k=random.randint(5, 40)))[:256],
+                 'timestamp': started + timedelta(seconds=i)} for i in range(inserted, count)])
+            db.session.execute(User.__table__.update().values(post_count=count))
+            db.session.commit()
+            inserted = count
+
+            for export_format in export.FORMATS:
+                for compress in (False, True):
+                    filename = export.new_filename(user.id, export_format, compress)
+                    SMTPSink.received = 0
+                    peak, elapsed = measure(tasks.export_posts, user.id, export_format, compress, filename,
+                                            f'http://localhost/exports/{filename}')
+                    size = os.path.getsize(os.path.join(os.environ['EXPORT_PATH'], filename))
+                    name = f'{export_format}{" gzip" if compress else ""}'
+                    print(f'{count:>8} {name:<12} {peak:>9.1f} {elapsed:>9.2f} {size / 1024 / 1024:>9.1f} '
+                          f'{SMTPSink.received / 1024:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares the built-in search engine with Elasticsearch on synthetic posts: bulk indexing throughput and query
+latency percentiles. Elasticsearch is benchmarked only if ELASTICSEARCH_URL is set or passed with --elasticsearch.
+
+    python benchmarks/search_benchmark.py --docs 100000 --queries 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.local_search import LocalSearchBackend  # noqa: E402
+from app.search import ElasticsearchBackend  # noqa: E402
+
+INDEX = 'benchmark-post'
+
+
+def generate_posts(count: int, vocabulary: list[str]) -> list[str]:
+    """Returns post bodies with Zipf-distributed words like in natural language"""
+
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    return [' '.join(random.choices(vocabulary, weights, k=random.randint(5, 40))) for _ in range(count)]
+
+
+def percentile(values: list[float], share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(name: str, backend, posts: list[str], queries: list[str], chunk_size: int, refresh=None) -> None:
+    backend.create_index(INDEX)
+
+    started = perf_counter()
+    for start in range(0, len(posts), chunk_size):
+        backend.bulk(INDEX, [('index', id, {'body': posts[id - 1]})
+                             for id in range(start + 1, min(start + chunk_size, len(posts)) + 1)])
+    if refresh:
+        refresh()
+    indexing_time = perf_counter() - started
+
+    latencies = []
+    for query in queries:
+        started = perf_counter()
+        backend.query(INDEX, query, random.randint(1, 5), 10)
+        latencies.append((perf_counter() - started) * 1000)
+
+    print(f'{name:<14} {len(posts) / indexing_time:>12.0f} {statistics.median(latencies):>9.2f} '
+          f'{percentile(latencies, 0.95):>9.2f} {percentile(latencies, 0.99):>9.2f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=50000, help='number of posts to index')
+    parser.add_argument('--queries', type=int, default=300, help='number of search queries to run')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='posts sent in one bulk request')
+    parser.add_argument('--elasticsearch', default=os.environ.get('ELASTICSEARCH_URL'), help='Elasticsearch url')
+    args = parser.parse_args()
+
+    random.seed(42)
+    vocabulary = [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=random.randint(3, 9)))
+                  for _ in range(20000)]
+    posts = generate_posts(args.docs, vocabulary)
+    queries = [' '.join(random.choices(vocabulary[:5000], k=random.randint(1, 3))) for _ in range(args.queries)]
+
+    print(f'{args.docs} posts, {args.queries} queries')
+    print(f'{"backend":<14} {"indexed/s":>12} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        run('built-in', LocalSearchBackend(os.path.join(directory, 'search.db')), posts, queries, args.chunk_size)
+
+    if args.elasticsearch:
+        backend = ElasticsearchBackend(args.elasticsearch)
+        if backend.client.indices.exists(index=INDEX):
+            backend.client.indices.delete(index=INDEX)
+        try:
+            run('elasticsearch', backend, posts, queries, args.chunk_size,
+                refresh=lambda: backend.client.indices.refresh(index=INDEX))
+        finally:
+            backend.client.indices.delete(index=INDEX)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,6 @@
 source venv/bin/activate
 flask db upgrade
 flask translate compile
-exec gunicorn -b :5000 --access-logfile - --error-logfile - blog:app
+# Every notification stream holds a thread: threads beyond the streams are left for the other requests
+export NOTIFICATION_STREAMS_PER_WORKER=${NOTIFICATION_STREAMS_PER_WORKER:-20}
+exec gunicorn -b :5000 --worker-class gthread --threads ${GUNICORN_THREADS:-32} --access-logfile - --error-logfile - blog:app
@@ -11,6 +11,14 @@ class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     POSTS_PER_PAGE = 5
 
+    # Home timeline variables: posts kept per user, idle timeline lifetime and followers limit for fan-out
+    TIMELINE_LENGTH = 800
+    TIMELINE_TTL = 7 * 24 * 3600
+    TIMELINE_FANOUT_MAX_FOLLOWERS = 10000
+
+    # Follow graph variable: lifetime of the sets of followed users mirrored in Redis
+    FOLLOW_GRAPH_TTL = 24 * 3600
+
     # Database variables
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', '').replace('postgres://', 'postgresql://')\
                               or 'sqlite:///' + os.path.join(basedir, 'app.db')
@@ -25,12 +33,48 @@ class Config(object):
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['zhuk.irina.2000@gmail.com']
 
-    # Translation variables
+    # Translation variables: translator requests time out after (connect, read) TRANSLATOR_TIMEOUT seconds,
+    # translations are cached in Redis for TRANSLATION_CACHE_TTL seconds and in each process for the latest ones,
+    # posts viewed TRANSLATION_PREFETCH_VIEWS times are translated into all the LANGUAGES in background
     LANGUAGES = ['en', 'ru']
     MS_TRANSLATOR_KEY = os.environ.get('MS_TRANSLATOR_KEY')
+    MS_TRANSLATOR_REGION = os.environ.get('MS_TRANSLATOR_REGION') or 'westus2'
+    TRANSLATOR_TIMEOUT = (3.05, 10)
+    TRANSLATOR_POOL_SIZE = 10
+    TRANSLATION_CACHE_TTL = 30 * 24 * 3600
+    TRANSLATION_LRU_SIZE = 1024
+    TRANSLATION_PREFETCH_VIEWS = 20
 
-    # Search variable
+    # Search variables: built-in engine stores its index at SEARCH_INDEX_PATH when Elasticsearch is not configured,
+    # results are cached for SEARCH_CACHE_TTL seconds, index changes are sent from the outbox in batches
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH') or os.path.join(basedir, 'search.db')
+    SEARCH_CACHE_TTL = 300
+    SEARCH_OUTBOX_BATCH = 500
+
+    # Background tasks report progress at most once per TASK_PROGRESS_INTERVAL seconds, banner of the tasks in progress
+    # is cached for TASK_BANNER_TTL seconds, exported posts are saved to EXPORT_PATH shared by the web and worker
+    # processes and can be downloaded for EXPORT_TTL seconds
+    TASK_PROGRESS_INTERVAL = 1.0
+    TASK_BANNER_TTL = 5
+    EXPORT_PATH = os.environ.get('EXPORT_PATH') or os.path.join(basedir, 'exports')
+    EXPORT_TTL = 7 * 24 * 3600
+
+    # Last seen times of the users are written to the database at most once per LAST_SEEN_FLUSH_INTERVAL seconds
+    LAST_SEEN_FLUSH_INTERVAL = 60
+
+    # Notification variables: notifications are kept in Redis for NOTIFICATION_TTL seconds unless 'sql' backend is set,
+    # open streams per worker process (0 disables streams: every stream holds a thread, so they need threaded or async
+    # workers), stream heartbeat interval and stream lifetime in seconds
+    NOTIFICATION_BACKEND = os.environ.get('NOTIFICATION_BACKEND') or 'redis'
+    NOTIFICATION_TTL = 7 * 24 * 3600
+    NOTIFICATION_STREAMS_PER_WORKER = int(os.environ.get('NOTIFICATION_STREAMS_PER_WORKER') or 0)
+    NOTIFICATION_STREAM_HEARTBEAT = 15
+    NOTIFICATION_STREAM_TIMEOUT = 300
+
+    # API token variables: 'stored' tokens are kept in the database, 'signed' ones are stateless JWTs revoked in Redis
+    API_TOKEN_TYPE = os.environ.get('API_TOKEN_TYPE') or 'stored'
+    API_TOKEN_MAX_EXPIRES_IN = 24 * 3600
 
     # Redis variable
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
@@ -39,3 +83,5 @@ class Config(object):
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    ELASTICSEARCH_URL = None
+    SEARCH_INDEX_PATH = None
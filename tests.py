@@ -1,10 +1,27 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
 from hashlib import md5
 
+import rq
+
 import config
-from app import db, create_app
-from app.models import User, Post
+from app import api_tokens, bulk_import, db, create_app, export, follow_graph, last_seen, notification_store, push, \
+    search, timeline, translate
+from app.local_search import LocalSearchBackend
+from app.models import User, Post, Message, PostTranslation, SearchOutbox, Task
+from app.pagination import paginate_keyset
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
 
 
 class UserModelTest(unittest.TestCase):
@@ -58,6 +75,239 @@ class UserModelTest(unittest.TestCase):
         self.assertEqual(user2.followers.count(), 1)
         self.assertTrue(user1.is_following(user2))
         self.assertFalse(user2.is_following(user1))
+        self.assertFalse(user1.is_mutual_follow(user2))
+        self.assertEqual(user1.get_followed_ids_among([user1.id, user2.id]), {user2.id})
+
+        user2.follow(user1)
+        self.assertTrue(user1.is_mutual_follow(user2))
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_follow_graph(self):
+        """Testing sets of the followed users materialized in Redis and kept up to date by the committed changes"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.task_queue = mock.Mock()
+        user1, user2, user3 = [User(username=name, email=f'{name}@gmail.com') for name in ('ira', 'dasha', 'masha')]
+        db.session.add_all([user1, user2, user3])
+        db.session.commit()
+        user1.follow(user2)
+        db.session.commit()
+
+        def members(user):
+            return {int(id) for id in self.app.redis.smembers(f'follow-graph:{user.id}')} - {0}
+
+        with mock.patch.object(User, '_load_followed_ids', side_effect=User._load_followed_ids) as load:
+            self.assertEqual(User.follows([(user1.id, user2.id), (user1.id, user3.id), (user2.id, user1.id)]),
+                             [True, False, False])
+            self.assertEqual((members(user1), members(user2)), ({user2.id}, set()))
+            self.assertTrue(user1.is_following(user2))
+            self.assertEqual(load.call_count, 1)
+
+        user1.follow(user3)
+        user1.unfollow(user2)
+        db.session.commit()
+        self.assertEqual(members(user1), {user3.id})
+        self.assertEqual(User.follows([(user1.id, user2.id), (user1.id, user3.id)]), [False, True])
+
+        # A follow committed while the set is loaded may be missing in it, so the set is not saved
+        def load_during_follow(user_ids):
+            followed_ids = User._load_followed_ids(user_ids)
+            user3.follow(user1)
+            db.session.commit()
+            return followed_ids
+
+        self.assertEqual(follow_graph.fill([user3.id], load_during_follow), {user3.id: set()})
+        self.assertFalse(self.app.redis.exists(f'follow-graph:{user3.id}'))
+        self.assertTrue(user3.is_following(user1))
+
+    def test_counters(self):
+        """Testing denormalized post, follower, followed and unread message counters"""
+
+        user1 = User(username='ira', email='ira@gmail.com')
+        user2 = User(username='dasha', email='dasha@gmail.com')
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        user1.follow(user2)
+        post = Post(body='post from dasha', author=user2)
+        db.session.add_all([post, Post(body='one more post from dasha', author=user2)])
+        db.session.commit()
+        self.assertEqual((user1.followed_count, user1.follower_count, user1.post_count), (1, 0, 0))
+        self.assertEqual((user2.followed_count, user2.follower_count, user2.post_count), (0, 1, 2))
+
+        user1.unfollow(user2)
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual((user1.followed_count, user2.follower_count, user2.post_count), (0, 0, 1))
+
+        db.session.add_all([Message(author=user1, recipient=user2, body='hi'),
+                            Message(author=user1, recipient=user2, body='hi again')])
+        db.session.commit()
+        self.assertEqual(user2.new_messages(), 2)
+        user2.read_messages()
+        db.session.commit()
+        self.assertEqual(user2.new_messages(), 0)
+
+        user2.post_count = 10
+        user1.unread_message_count = 5
+        db.session.commit()
+        User.recount()
+        db.session.commit()
+        self.assertEqual((user2.post_count, user1.unread_message_count), (1, 0))
+
+    def test_import_follows(self):
+        """Testing idempotent follow and bulk import of follows"""
+
+        user1 = User(username='ira', email='ira@gmail.com')
+        user2 = User(username='dasha', email='dasha@gmail.com')
+        user3 = User(username='masha', email='masha@gmail.com')
+        db.session.add_all([user1, user2, user3])
+        db.session.commit()
+
+        user1.follow(user2)
+        user1.follow(user2)
+        db.session.commit()
+        self.assertEqual((user1.followed.count(), user1.followed_count, user2.follower_count), (1, 1, 1))
+
+        added = User.import_follows([(user1.id, user2.id), (user1.id, user3.id), (user1.id, user3.id),
+                                     (user2.id, user2.id), (user3.id, user1.id), (user3.id, 1000)])
+        db.session.commit()
+        self.assertEqual(added, 2)
+        self.assertEqual((user1.followed_count, user1.follower_count, user3.follower_count), (2, 1, 1))
+        self.assertTrue(user3.is_mutual_follow(user1))
+
+    def test_bulk_import(self):
+        """Testing bulk import of users and posts"""
+
+        users = io.StringIO('{"username": "ira", "email": "ira@gmail.com", "password": "ira"}\n'
+                            'malformed line\n'
+                            '{"username": "ira", "email": "ira2@gmail.com", "password": "ira"}\n'
+                            '{"username": "dasha", "email": "dasha@gmail.com", "password_hash": "pbkdf2:sha256:1$a$b",'
+                            ' "about_me": "' + 'a' * 200 + '"}\n'
+                            '{"username": "masha", "email": "masha@gmail.com", "password_hash": 12345}\n'
+                            '{"username": "sasha", "email": "sasha@gmail.com", "password_hash": "' + 'h' * 129 + '"}\n'
+                            '{"username": "pasha", "email": "pasha@gmail.com", "password": ["pasha"]}\n'
+                            '{"username": "glasha", "email": "glasha@gmail.com", "password": "glasha",'
+                            ' "about_me": {"text": "about"}}\n')
+        (records, malformed), = bulk_import.read_ndjson(users, 10)
+        self.assertEqual((len(records), malformed), (7, 1))
+        self.assertEqual(bulk_import.import_users(records), 3)
+        db.session.commit()
+        user = User.query.filter_by(username='ira').first()
+        self.assertTrue(user.check_password('ira'))
+        self.assertEqual(len(User.query.filter_by(username='dasha').first().about_me), 128)
+        self.assertIsNone(User.query.filter_by(username='glasha').first().about_me)
+
+        self.assertEqual(bulk_import.import_posts([
+            {'user_id': user.id, 'body': 'post from ira', 'timestamp': '2022-01-01T12:00:00+03:00'},
+            {'username': 'dasha', 'body': 'post from dasha', 'language': 'en'},
+            {'username': 'masha', 'body': 'post from unknown user'},
+            {'user_id': True, 'body': 'post with boolean user id'},
+            {'user_id': [user.id], 'body': 'post with list user id'},
+            {'username': ['dasha'], 'body': 'post with list username'}
+        ]), (2, 1))
+        db.session.commit()
+        self.assertEqual(user.post_count, 1)
+        self.assertEqual((user.posts.first().timestamp, user.posts.first().language), (datetime(2022, 1, 1, 9), ''))
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_last_seen(self):
+        """Testing buffering of the latest last seen times written by one job per interval"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.task_queue = mock.Mock()
+        user = User(username='john', email='john@example.com', last_seen=datetime(2020, 1, 1))
+        db.session.add(user)
+        db.session.commit()
+
+        with mock.patch('app.last_seen.time', side_effect=[1000.0, 1030.0, 1010.0]):
+            for _ in range(3):
+                last_seen.touch(user.id)
+        self.app.task_queue.enqueue_in.assert_called_once_with(timedelta(seconds=60), 'app.tasks.flush_last_seen')
+
+        with mock.patch('app.last_seen._write', side_effect=ConnectionError('database is not available')):
+            with self.assertRaises(ConnectionError):
+                last_seen.flush()
+
+        # The time recorded while the previous one is written is kept for the next flush
+        def write_during_touch(pending):
+            with mock.patch('app.last_seen.time', return_value=1090.0):
+                last_seen.touch(user.id)
+            write(pending)
+
+        write = last_seen._write
+        with mock.patch('app.last_seen._write', side_effect=write_during_touch):
+            self.assertEqual(last_seen.flush(), 1)
+        db.session.refresh(user)
+        self.assertEqual(user.last_seen, datetime.utcfromtimestamp(1030))
+        self.assertEqual(last_seen.flush(), 1)
+        db.session.refresh(user)
+        self.assertEqual(user.last_seen, datetime.utcfromtimestamp(1090))
+        self.assertEqual(last_seen.flush(), 0)
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_token_cache(self):
+        """Testing that a token read from the database before its revocation is not cached again"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        user = User(username='john', email='john@example.com')
+        db.session.add(user)
+        token = user.get_token()
+        db.session.commit()
+        self.assertEqual(User.get_user_id_by_token(token), user.id)
+        self.assertEqual(api_tokens.get_cached_user_id(token), (user.id, 0))
+
+        # A request reading the token before the revocation fills the cache after it
+        _, generation = api_tokens.get_cached_user_id(token)
+        user.revoke_token()
+        db.session.commit()
+        api_tokens.cache_user_id(token, user.id, datetime.utcnow() + timedelta(hours=1), generation)
+        self.assertEqual(api_tokens.get_cached_user_id(token), (None, 1))
+        self.assertIsNone(User.get_user_id_by_token(token))
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_task_progress(self):
+        """Testing progress of several tasks fetched in one Redis round trip"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        user = User(username='john', email='john@example.com')
+        tasks = [Task(id=id, name='export_posts', user=user) for id in ('started', 'running', 'finished')]
+        db.session.add_all(tasks)
+        db.session.commit()
+        for id, progress in (('started', None), ('running', 40)):
+            job = rq.job.Job.create('app.tasks.export_posts', id=id, connection=self.app.redis)
+            if progress is not None:
+                job.meta['progress'] = progress
+            job.save()
+
+        with mock.patch.object(self.app.redis, 'pipeline', wraps=self.app.redis.pipeline) as pipeline, \
+                mock.patch.object(self.app.redis, 'execute_command', wraps=self.app.redis.execute_command) as command:
+            self.assertEqual(Task.get_progress_many(tasks), {'started': 0, 'running': 40, 'finished': 100})
+        self.assertEqual((pipeline.call_count, command.call_count), (1, 0))
+
+    def test_task_banner(self):
+        """Testing the cached task banner dropped when a task of the user is launched or completed"""
+
+        self.app.task_queue = mock.Mock()
+        self.app.task_queue.enqueue.return_value.get_id.return_value = 'job-id'
+        user = User(username='john', email='john@example.com')
+        db.session.add(user)
+        db.session.commit()
+
+        with mock.patch.object(User, 'get_tasks_in_progress', autospec=True,
+                               side_effect=User.get_tasks_in_progress) as get_tasks:
+            self.assertEqual(user.get_task_banner(), [])
+            self.assertEqual(user.get_task_banner(), [])
+            self.assertEqual(get_tasks.call_count, 1)
+
+            task = user.launch_task('export_posts', 'Exporting posts')
+            db.session.commit()
+            self.assertEqual(user.get_task_banner(), [{'id': 'job-id', 'description': 'Exporting posts',
+                                                       'progress': 100}])
+            task.set_complete()
+            db.session.commit()
+            self.assertEqual(user.get_task_banner(), [])
+            self.assertEqual(get_tasks.call_count, 3)
 
     def test_followed_posts(self):
         """Testing followed posts"""
@@ -91,6 +341,622 @@ class UserModelTest(unittest.TestCase):
         self.assertEqual(user3.get_posts_from_followed_users().all(), [post3, post4])
         self.assertEqual(user4.get_posts_from_followed_users().all(), [post4])
 
+    def test_timeline_database_fallback(self):
+        """Testing home timeline pages when the materialized timeline is not available"""
+
+        user1 = User(username='john', email='john@example.com')
+        user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([user1, user2])
+        now = datetime.utcnow()
+        posts = [Post(body=f'post {i}', author=user2, timestamp=now + timedelta(seconds=i)) for i in range(3)]
+        db.session.add_all(posts)
+        user1.follow(user2)
+        db.session.commit()
+
+        first_page = user1.get_timeline(2)
+        self.assertEqual(first_page.items, [posts[2], posts[1]])
+        self.assertIsNone(first_page.prev_cursor)
+        second_page = user1.get_timeline(2, before=first_page.next_cursor)
+        self.assertEqual(second_page.items, [posts[0]])
+        self.assertIsNone(second_page.next_cursor)
+        self.assertEqual(user1.get_timeline(2, after=second_page.prev_cursor).items, [posts[2], posts[1]])
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_timeline_shared_timestamps(self):
+        """Testing materialized home timeline pages over more posts sharing a timestamp than a page holds"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        self.app.task_queue = mock.Mock()
+        user1 = User(username='john', email='john@example.com')
+        user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([user1, user2])
+        now = datetime.utcnow()
+        posts = [Post(body=f'post {i}', author=user2, timestamp=now + timedelta(seconds=i // 15)) for i in range(30)]
+        db.session.add_all(posts)
+        user1.follow(user2)
+        db.session.commit()
+        posts.sort(key=lambda post: (post.timestamp, post.id), reverse=True)
+        timeline.replace(user1.id, [(post.id, post.timestamp) for post in posts])
+
+        with mock.patch.object(User, 'get_posts_from_followed_users', side_effect=AssertionError('database query')):
+            pages = [user1.get_timeline(4)]
+            while pages[-1].next_cursor:
+                pages.append(user1.get_timeline(4, before=pages[-1].next_cursor))
+            self.assertEqual([post for page in pages for post in page.items], posts)
+            self.assertEqual(user1.get_timeline(4, after=pages[3].prev_cursor).items, posts[8:12])
+
+    def test_keyset_pagination(self):
+        """Testing cursor pagination over posts sharing timestamps"""
+
+        user = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        posts = [Post(body=f'post {i}', author=user, timestamp=now + timedelta(seconds=i // 2)) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        columns = [Post.timestamp, Post.id]
+        pages = [paginate_keyset(Post.query, columns, 2)]
+        while pages[-1].next_cursor:
+            pages.append(paginate_keyset(Post.query, columns, 2, before=pages[-1].next_cursor))
+        self.assertEqual([page.items for page in pages], [[posts[4], posts[3]], [posts[2], posts[1]], [posts[0]]])
+
+        newer_page = paginate_keyset(Post.query, columns, 2, after=pages[2].prev_cursor)
+        self.assertEqual(newer_page.items, [posts[2], posts[1]])
+        self.assertEqual(paginate_keyset(Post.query, columns, 2, before='malformed').items, pages[0].items)
+
+    def test_export(self):
+        """Testing export of posts sharing timestamps into the file replacing the previous export"""
+
+        user = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        db.session.add_all([Post(body=f'post {i}', author=user, timestamp=now + timedelta(seconds=i // 2))
+                            for i in range(5)])
+        db.session.commit()
+
+        with tempfile.TemporaryDirectory() as directory:
+            previous = export.new_filename(user.id, 'csv')
+            export.save_posts(export.read_posts(user.id), directory, previous, 'csv')
+            filename = export.new_filename(user.id, 'ndjson', compress=True)
+            path = export.save_posts(export.read_posts(user.id, chunk_size=2), directory, filename, 'ndjson', True)
+
+            self.assertEqual(os.listdir(directory), [filename])
+            with gzip.open(path, 'rt') as file:
+                self.assertEqual([json.loads(line)['body'] for line in file], [f'post {i}' for i in range(5)])
+        self.assertEqual(export.get_download_name(filename), 'posts.ndjson.gz')
+        self.assertTrue(export.is_owner(filename, user.id))
+        self.assertFalse(export.is_owner(filename, user.id + 1))
+        self.assertFalse(export.is_owner(f'{user.id}-x/../{filename}', user.id))
+
+
+class QueryPlanTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """Creates database with a few rows, so the pages have cursors"""
+
+        self.app = create_app(config.TestConfig)
+        self.app.config['NOTIFICATION_BACKEND'] = 'sql'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user1 = User(username='john', email='john@example.com')
+        self.user2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+        self.user1.follow(self.user2)
+        now = datetime.utcnow()
+        db.session.add_all([Post(body=f'post {i}', author=self.user2 if i % 2 else self.user1,
+                                 timestamp=now + timedelta(seconds=i)) for i in range(6)])
+        db.session.add_all([Message(author=self.user2, recipient=self.user1, body=f'message {i}') for i in range(6)])
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        """Clears test database after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertNoFullScan(self, function, allowed=()) -> None:
+        """
+        Runs {function} and fails if EXPLAIN QUERY PLAN of any statement it executes scans a whole table,
+        except for the {allowed} plan steps
+        """
+
+        statements = []
+
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        db.event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            function()
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertTrue(statements)
+        for statement, parameters in statements:
+            plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            for step in [row[3] for row in plan]:
+                # 'SCAN <table>' reads the whole table or index, 'SEARCH <table>' looks rows up by an index
+                if step.startswith('SCAN ') and step.split()[1] in db.metadata.tables and step not in allowed:
+                    self.fail(f'{step} in the plan of {statement}')
+
+    def assertPagesNoFullScan(self, query, columns, allowed=()) -> None:
+        """Checks plans of the first and the next page of {query} paginated by {columns}"""
+
+        def paginate():
+            page = paginate_keyset(query, columns, 2)
+            paginate_keyset(query, columns, 2, before=page.next_cursor)
+
+        self.assertNoFullScan(paginate, allowed)
+
+    def test_timeline(self):
+        """Testing plans of the home timeline served by the database"""
+
+        self.assertNoFullScan(lambda: self.user1.get_timeline(2, before=self.user1.get_timeline(2).next_cursor))
+
+    def test_explore(self):
+        """Testing plans of the explore pages: the newest posts are read from the timestamp index"""
+
+        self.assertPagesNoFullScan(Post.eager_load(Post.query), [Post.timestamp, Post.id],
+                                   allowed=['SCAN post USING INDEX ix_post_timestamp'])
+
+    def test_profile(self):
+        """Testing plans of the user's posts and follows pages"""
+
+        self.assertPagesNoFullScan(Post.eager_load(self.user2.posts), [Post.timestamp, Post.id])
+        self.assertPagesNoFullScan(self.user2.followers, [User.id])
+        self.assertPagesNoFullScan(self.user1.followed, [User.id])
+
+    def test_inbox(self):
+        """Testing plans of the received messages pages"""
+
+        self.assertPagesNoFullScan(self.user1.messages_received.options(db.joinedload(Message.author)),
+                                   [Message.timestamp, Message.id])
+
+    def test_notifications(self):
+        """Testing plans of the notifications and tasks in progress stored in the database"""
+
+        self.assertNoFullScan(lambda: self.user1.add_notification('unread_message_count', 6))
+        self.assertNoFullScan(lambda: self.user1.get_notifications(0))
+        self.assertNoFullScan(self.user1.get_tasks_in_progress)
+
+    def test_token_lookup(self):
+        """Testing plan of the API token lookup"""
+
+        self.assertNoFullScan(lambda: User.get_user_id_by_token('unknown-token'))
+
+    def test_post_authors(self):
+        """Testing that authors of the page posts are loaded with the posts, not by a query per author"""
+
+        # Banners cached by the other tests of the process would skip the query of the tasks
+        self.app.config['TASK_BANNER_TTL'] = 0
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(self.user1.id)
+        statements = []
+
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        def count_queries(url: str) -> int:
+            statements.clear()
+            db.event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.assertEqual(client.get(url).status_code, 200)
+            finally:
+                db.event.remove(db.engine, 'before_cursor_execute', record)
+            db.session.remove()
+            return len(statements)
+
+        # Every page loads the signed in user instead of finding it in the session
+        db.session.remove()
+        urls = ['/index', '/explore', '/user_profile/susan']
+        counts = [count_queries(url) for url in urls]
+
+        # The newest posts are written by as many authors as the page shows
+        authors = [User(username=f'author{i}', email=f'author{i}@example.com') for i in range(5)]
+        now = datetime.utcnow() + timedelta(minutes=1)
+        db.session.add_all([Post(body=f'post of {author.username}', author=author, timestamp=now + timedelta(seconds=i))
+                            for i, author in enumerate(authors)])
+        db.session.add_all([Post(body=f'new post {i}', author=self.user2, timestamp=now + timedelta(seconds=i))
+                            for i in range(5)])
+        db.session.commit()
+        for author in authors:
+            User.query.get(self.user1.id).follow(author)
+        db.session.commit()
+        db.session.remove()
+
+        self.assertEqual([count_queries(url) for url in urls], counts)
+
+
+class LocalSearchTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """Creates index database for testing"""
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = LocalSearchBackend(os.path.join(self.directory.name, 'search.db'))
+
+    def tearDown(self) -> None:
+        """Removes test index database"""
+
+        self.directory.cleanup()
+
+    def test_query(self):
+        """Testing ranking, pagination and updates of the built-in search engine"""
+
+        self.backend.bulk('post', [('index', 1, {'body': 'the quick brown fox'}),
+                                   ('index', 2, {'body': 'lazy dog'}),
+                                   ('index', 3, {'body': 'quick quick fox'})])
+        self.assertEqual(self.backend.query('post', 'quick', 1, 10), ([(3, None), (1, None)], 2))
+        self.assertEqual(self.backend.query('post', 'fox OR dog"', 1, 2), ([(2, None), (3, None)], 3))
+        self.assertEqual(self.backend.query('message', 'fox', 1, 10), ([], 0))
+
+        self.backend.bulk('post', [('index', 3, {'body': 'slow turtle'}), ('delete', 1, None)])
+        self.assertEqual(self.backend.query('post', 'quick', 1, 10), ([], 0))
+
+        self.backend.index('post', 4, {'body': 'stored fields', 'stored': {'body': 'stored fields'}})
+        self.assertEqual(self.backend.query('post', 'stored', 1, 10), ([(4, {'body': 'stored fields'})], 1))
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_cache(self):
+        """Testing search results cache hits and invalidation by the index changes"""
+
+        app = create_app(config.TestConfig)
+        app.search_backend = self.backend
+        app.redis = fakeredis.FakeRedis()
+        with app.app_context(), mock.patch.object(self.backend, 'query', wraps=self.backend.query) as query:
+            search.bulk_index('post', [('index', 1, {'body': 'quick fox'})])
+            self.assertEqual(search.query_index('post', 'Quick  fox', 1, 10), ([1], 1))
+            self.assertEqual(search.query_index('post', 'quick fox', 1, 10), ([1], 1))
+            self.assertEqual(query.call_count, 1)
+
+            search.bulk_index('post', [('index', 2, {'body': 'quick fox again'})])
+            self.assertEqual(search.query_index('post', 'quick fox', 1, 10), ([1, 2], 2))
+            self.assertEqual(query.call_count, 2)
+            self.assertEqual(search.get_cache_stats(), {'post': (3, 1)})
+
+            search.query_index_documents('post', 'quick fox', 1, 10, ['body'])
+            search.query_index_documents('post', 'quick fox', 1, 10, ['body'])
+            self.assertEqual(query.call_count, 3)
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_reindex_resume(self):
+        """Testing reindex into a new index interrupted with a chunk in flight and resumed from the checkpoint"""
+
+        app = create_app(config.TestConfig)
+        app.search_backend = mock.Mock()
+        app.redis = fakeredis.FakeRedis()
+        later_chunk_sent = threading.Event()
+
+        def bulk(index, actions):
+            id = actions[0][1]
+            if id == 2:
+                # Fails after the next chunk is sent, so its id must not be checkpointed
+                later_chunk_sent.wait(5)
+                raise ConnectionError('backend is not available')
+            later_chunk_sent.set()
+            return set()
+
+        def read_chunks(after_id):
+            for id in range(after_id + 1, 5):
+                yield id, [('index', id, {'body': f'post {id}'})]
+
+        with app.app_context():
+            app.search_backend.bulk.side_effect = bulk
+            with self.assertRaises(ConnectionError):
+                search.reindex('post', read_chunks, 2, new_index=True)
+            target = app.redis.hget('search:reindex:post', 'target').decode('utf-8')
+            self.assertEqual(app.redis.hget('search:reindex:post', 'last_id'), b'1')
+            app.search_backend.swap_alias.assert_not_called()
+
+            app.search_backend.bulk.side_effect = None
+            app.search_backend.bulk.return_value = set()
+            self.assertEqual(search.reindex('post', read_chunks, 2, new_index=True, resume=True), 3)
+            self.assertEqual([call.args[1][0][1] for call in app.search_backend.bulk.call_args_list[-3:]], [2, 3, 4])
+            self.assertEqual({call.args[0] for call in app.search_backend.bulk.call_args_list}, {target})
+            app.search_backend.create_index.assert_called_once_with(target)
+            app.search_backend.swap_alias.assert_called_once_with('post', target)
+            self.assertFalse(app.redis.exists('search:reindex:post'))
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_index_after(self):
+        """Testing indexing of the imported posts leaving the state of a running reindex as it is"""
+
+        app = create_app(config.TestConfig)
+        app.search_backend = self.backend
+        app.redis = fakeredis.FakeRedis()
+        with app.app_context():
+            db.create_all()
+            user = User(username='john', email='john@example.com')
+            db.session.add_all([Post(body=f'imported post {i}', author=user, language='en') for i in range(3)])
+            db.session.commit()
+            state = {b'target': b'post-1', b'last_id': b'1'}
+            app.redis.hset('search:reindex:post', mapping=state)
+
+            self.assertEqual(Post.index_after(1, chunk_size=1, workers=2), 2)
+            self.assertEqual(app.redis.hgetall('search:reindex:post'), state)
+            self.assertEqual(self.backend.query('post', 'imported', 1, 10)[1], 2)
+            self.assertEqual(self.backend.query('post-1', 'imported', 1, 10)[1], 2)
+            db.session.remove()
+            db.drop_all()
+
+
+class TranslationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """Creates database for testing and replaces the translator with one prefixing texts with the language"""
+
+        self.app = create_app(config.TestConfig)
+        self.app.config['MS_TRANSLATOR_KEY'] = 'key'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.requests = []
+        session = mock.patch.object(translate, '_get_session', return_value=mock.Mock(post=self.post))
+        session.start()
+        self.addCleanup(session.stop)
+        translate._lru = None
+
+    def tearDown(self) -> None:
+        """Clears test database after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        translate._lru = None
+
+    def post(self, url, params, headers, json, timeout):
+        """Answers the translator request like the translator API"""
+
+        self.requests.append([item['Text'] for item in json])
+        response = mock.Mock()
+        response.json.return_value = [{'translations': [{'text': f'{params["to"]}:{item["Text"]}'}]} for item in json]
+
+        return response
+
+    def test_batches(self):
+        """Testing translation of the texts in batches keeping their order"""
+
+        texts = [f'text {i % 150}' for i in range(160)]
+        self.assertEqual(translate.translate_texts(texts, 'es', 'en'), [f'en:{text}' for text in texts])
+        self.assertEqual([len(batch) for batch in self.requests], [translate.BATCH_SIZE, 50])
+
+    def test_cache(self):
+        """Testing translations cached in the process and in Redis"""
+
+        if fakeredis:
+            self.app.redis = fakeredis.FakeRedis()
+        translate.translate_texts(['hola', 'adios'], 'es', 'en')
+        self.assertEqual(translate.translate_texts(['adios', 'gracias'], 'es', 'en'), ['en:adios', 'en:gracias'])
+        self.assertEqual(self.requests, [['hola', 'adios'], ['gracias']])
+
+        if fakeredis:
+            translate._lru = None
+            self.assertEqual(translate.translate_texts(['hola'], 'es', 'en'), ['en:hola'])
+            self.assertEqual(len(self.requests), 2)
+
+    def test_batch_route(self):
+        """Testing translation of the page posts stored for the next requests"""
+
+        user = User(username='john', email='john@example.com')
+        posts = [Post(body='hola', author=user, language='es'), Post(body='hi', author=user, language='en'),
+                 Post(body='salut', author=user, language='fr')]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        for _ in range(2):
+            response = client.post('/translate/batch', json={'posts': [post.id for post in posts] + ['x'],
+                                                               'destination_language': 'en'})
+            self.assertEqual(response.get_json(), {'translations': {str(posts[0].id): 'en:hola',
+                                                                    str(posts[2].id): 'en:salut'}})
+        self.assertEqual(self.requests, [['hola'], ['salut']])
+        self.assertEqual(PostTranslation.query.count(), 2)
+
+        response = client.post('/translate/batch', json={'posts': [posts[0].id], 'destination_language': 'x' * 10})
+        self.assertEqual(response.get_json(), {'translations': {}})
+        response = client.post('/translate', data={'post_id': posts[0].id, 'destination_language': 'xx'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((len(self.requests), PostTranslation.query.count()), (2, 2))
+
+
+class NotificationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """Creates database with a signed in user for testing"""
+
+        self.app = create_app(config.TestConfig)
+        self.app.config.update(NOTIFICATION_STREAMS_PER_WORKER=1, NOTIFICATION_STREAM_HEARTBEAT=0.05,
+                               NOTIFICATION_STREAM_TIMEOUT=0.2)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        push._streams = None
+
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.user.id)
+
+    def tearDown(self) -> None:
+        """Clears test database after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        push._streams = None
+
+    def test_stream_fallbacks(self):
+        """Testing 503 responses making the page poll the notifications instead"""
+
+        self.app.config['NOTIFICATION_STREAMS_PER_WORKER'] = 0
+        self.assertEqual(self.client.get('/notifications/stream').status_code, 503)
+        self.app.config['NOTIFICATION_STREAMS_PER_WORKER'] = 1
+
+        # Redis of the test configuration is not available: the slot is released
+        self.assertEqual(self.client.get('/notifications/stream').status_code, 503)
+        self.assertTrue(push.acquire_stream())
+        push.release_stream()
+
+        if fakeredis:
+            self.app.redis = fakeredis.FakeRedis()
+            stream = self.client.get('/notifications/stream')
+            self.assertEqual(stream.status_code, 200)
+            self.assertEqual(self.client.get('/notifications/stream').get_json(), {'error': 'too many streams'})
+            stream.close()
+            stream = self.client.get('/notifications/stream')
+            self.assertEqual(stream.status_code, 200)
+            stream.close()
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_stream(self):
+        """Testing the missed notifications sent before the published ones"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        for name in ('received', 'missed'):
+            self.user.add_notification(name, 1)
+            db.session.commit()
+        received = self.user.get_notifications(0.0)[0]
+
+        response = self.client.get('/notifications/stream', headers={'Last-Event-ID': str(received['timestamp'])})
+        self.user.add_notification('published', 2)
+        db.session.commit()
+        events = [json.loads(line[6:]) for line in response.get_data(as_text=True).splitlines()
+                  if line.startswith('data: ')]
+        response.close()
+
+        self.assertEqual([(event['name'], event['data']) for event in events], [('missed', 1), ('published', 2)])
+        self.assertTrue(push.acquire_stream())
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+    def test_store(self):
+        """Testing the latest payload of each notification kept in Redis with increasing timestamps"""
+
+        self.app.redis = fakeredis.FakeRedis()
+        with mock.patch('app.notification_store.time', return_value=1000.0):
+            first = notification_store.store(self.user.id, 'unread_message_count', 1)
+            second = notification_store.store(self.user.id, 'task_progress', 50)
+            third = notification_store.store(self.user.id, 'unread_message_count', 2)
+        self.assertTrue(first < second < third)
+
+        self.assertEqual(self.user.get_notifications(0.0), [
+            {'name': 'task_progress', 'data': 50, 'timestamp': second},
+            {'name': 'unread_message_count', 'data': 2, 'timestamp': third}])
+        self.assertEqual([notification['name'] for notification in self.user.get_notifications(second)],
+                         ['unread_message_count'])
+        self.assertEqual(self.app.redis.ttl(f'notifications:latest:{self.user.id}'),
+                         self.app.config['NOTIFICATION_TTL'])
+
+    def test_sql_store(self):
+        """Testing notifications kept in the database with 'sql' backend"""
+
+        self.app.config['NOTIFICATION_BACKEND'] = 'sql'
+        self.user.add_notification('unread_message_count', 1)
+        db.session.commit()
+        since = self.user.get_notifications(0.0)[0]['timestamp']
+        self.user.add_notification('task_progress', 50)
+        self.user.add_notification('unread_message_count', 2)
+        db.session.commit()
+
+        self.assertEqual(self.user.notifications.count(), 2)
+        self.assertEqual([(notification['name'], notification['data'])
+                          for notification in self.user.get_notifications(since)],
+                         [('task_progress', 50), ('unread_message_count', 2)])
+
+
+class TaskTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """Creates database for testing and runs the background jobs in the test application"""
+
+        # The jobs module creates its own application on import
+        from app import tasks
+
+        self.tasks = tasks
+        self.app = create_app(config.TestConfig)
+        self.app.task_queue = mock.Mock()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        application = mock.patch.object(tasks, 'app', self.app)
+        application.start()
+        self.addCleanup(application.stop)
+
+    def tearDown(self) -> None:
+        """Clears test database after each test"""
+
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_search_outbox(self):
+        """Testing that only the latest searchable change of each object is sent and the failed ones are kept"""
+
+        self.app.search_backend = mock.Mock()
+        self.app.search_backend.bulk.return_value = set()
+        user = User(username='john', email='john@example.com')
+        posts = [Post(body=f'post {i}', author=user, language='en') for i in range(3)]
+        db.session.add_all(posts + [Message(body='message', author=user, recipient=user)])
+        db.session.commit()
+        user.about_me = 'not searchable'
+        db.session.commit()
+        self.assertEqual(SearchOutbox.query.count(), 3)
+
+        ids = [post.id for post in posts]
+        posts[0].body = 'edited post'
+        posts[2].body = 'edited post'
+        db.session.commit()
+        # Deleted without the session events, so the outbox has the index change of a missing post
+        Post.query.filter_by(id=ids[1]).delete()
+        db.session.commit()
+
+        self.app.search_backend.bulk.return_value = {ids[2]}
+        with self.assertRaises(RuntimeError):
+            self.tasks.index_search_outbox()
+        index, actions = self.app.search_backend.bulk.call_args.args
+        self.assertEqual((index, [(operation, id) for operation, id, payload in actions]),
+                         ('post', [('index', ids[0]), ('delete', ids[1]), ('index', ids[2])]))
+        self.assertEqual(actions[0][2]['body'], 'edited post')
+        self.assertEqual([change.object_id for change in SearchOutbox.query], [ids[2], ids[2]])
+
+        self.app.search_backend.bulk.return_value = set()
+        self.tasks.index_search_outbox()
+        self.assertEqual(SearchOutbox.query.count(), 0)
+
+    def test_progress_reporter(self):
+        """Testing progress reported only when the percentage changes once per interval and always on finish"""
+
+        user = User(username='john', email='john@example.com')
+        task = Task(id='job-id', name='export_posts', description='Exporting posts', user=user)
+        db.session.add(task)
+        db.session.commit()
+        reported = []
+        job = mock.Mock(meta={})
+        job.get_id.return_value = task.id
+        job.save_meta.side_effect = lambda: reported.append(job.meta['progress'])
+        clock = [0.0]
+
+        with mock.patch.object(self.tasks, 'get_current_job', return_value=job), \
+                mock.patch.object(self.tasks, 'monotonic', side_effect=lambda: clock[0]):
+            progress = self.tasks.ProgressReporter(total=200, min_interval=1)
+            for now in (0.0, 0.0, 0.5, 1.5, 3.0):
+                clock[0] = now
+                progress.advance()
+            progress.update(2)
+            self.assertEqual((reported, task.complete), ([0, 2], False))
+
+            progress.finish()
+            progress.finish()
+        self.assertEqual((reported, task.complete), ([0, 2, 100], True))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)